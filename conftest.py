@@ -0,0 +1,8 @@
+import pytest
+from django.core.cache import cache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Primary keys are reused between tests, so cached pages must not outlive a test."""
+    cache.clear()
@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -25,7 +25,7 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SECRET_KEY = config('SECRET_KEY')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = config('DEBUG')
+DEBUG = config('DEBUG', default=False, cast=bool)
 
 ALLOWED_HOSTS = ['127.0.0.1', '192.168.100.6']
 
@@ -40,13 +40,13 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 
     'crispy_forms',
-    'debug_toolbar',
 
     'polls.apps.PollsConfig',
 ]
 
 MIDDLEWARE = [
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'polls.middleware.InstrumentationMiddleware',
+    'polls.middleware.PrimaryPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,6 +56,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# The debug toolbar adds a lot of overhead to every request, keep it out of production.
+if DEBUG:
+    INSTALLED_APPS.insert(INSTALLED_APPS.index('polls.apps.PollsConfig'), 'debug_toolbar')
+    MIDDLEWARE.insert(0, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
@@ -87,6 +92,42 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database, e.g. DATABASE_REPLICAS=/srv/replica1.sqlite3,/srv/replica2.sqlite3.
+# polls.routers.ReplicaRouter sends reads to them; tests use the default database instead.
+for i, name in enumerate(config('DATABASE_REPLICAS', default='', cast=Csv()), 1):
+    DATABASES[f'replica{i}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['polls.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+# Use a shared backend (memcached, redis) when running several processes,
+# otherwise cache invalidations only reach the process that made them.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+
+# Sessions are read from the cache and written through to the database.
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.cached_db')
+
+# Loads the user of authenticated requests from the cache (see polls.auth for
+# what that puts in the cache). ModelBackend stays listed so that sessions
+# started before it was added still resolve their user; logins never reach it.
+AUTHENTICATION_BACKENDS = [
+    'polls.auth.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -135,3 +176,59 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 INTERNAL_IPS = [
     '127.0.0.1'
 ]
+
+# Polls
+
+# Buffer votes in memory and flush them to Choice.votes in batches
+POLLS_VOTE_BUFFER = config('POLLS_VOTE_BUFFER', default=False, cast=bool)
+POLLS_VOTE_BUFFER_SIZE = config('POLLS_VOTE_BUFFER_SIZE', default=100, cast=int)
+POLLS_VOTE_BUFFER_INTERVAL = config('POLLS_VOTE_BUFFER_INTERVAL', default=5.0, cast=float)
+POLLS_VOTE_JOURNAL_DIR = config('POLLS_VOTE_JOURNAL_DIR', default=os.path.join(BASE_DIR, 'var', 'journal'))
+
+# Timeout of cached question pages and fragments, in seconds
+POLLS_CACHE_TIMEOUT = config('POLLS_CACHE_TIMEOUT', default=600, cast=int)
+
+# Comments shown per page on the question page
+POLLS_COMMENTS_PER_PAGE = config('POLLS_COMMENTS_PER_PAGE', default=20, cast=int)
+
+# Live results stream (polls.live), served by mysite.asgi
+POLLS_LIVE_BROKER = config('POLLS_LIVE_BROKER', default='polls.live.LocalBroker')
+POLLS_LIVE_MAX_CONNECTIONS = config('POLLS_LIVE_MAX_CONNECTIONS', default=1000, cast=int)
+POLLS_LIVE_COALESCE_INTERVAL = config('POLLS_LIVE_COALESCE_INTERVAL', default=0.5, cast=float)
+
+# Spread votes over this many ChoiceShard rows per choice (0 disables sharding)
+POLLS_VOTE_SHARDS = config('POLLS_VOTE_SHARDS', default=0, cast=int)
+
+# Request instrumentation (polls.middleware): per-route stats, and Server-Timing headers for INTERNAL_IPS
+POLLS_INSTRUMENTATION = config('POLLS_INSTRUMENTATION', default=False, cast=bool)
+# Fraction of requests run under cProfile, e.g. 0.001
+POLLS_PROFILE_SAMPLE_RATE = config('POLLS_PROFILE_SAMPLE_RATE', default=0.0, cast=float)
+
+# Database aliases to read from, and how long a client reads from the primary after writing
+POLLS_DB_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+POLLS_DB_PIN_SECONDS = config('POLLS_DB_PIN_SECONDS', default=10, cast=int)
+
+# Rate limits of votes and comments per user and per IP address, as "<requests>/<seconds>" (empty disables).
+# The IP address is REMOTE_ADDR: behind a reverse proxy that doesn't set it to the client's, leave the IP limit off.
+POLLS_RATE_LIMIT_USER = config('POLLS_RATE_LIMIT_USER', default='')
+POLLS_RATE_LIMIT_IP = config('POLLS_RATE_LIMIT_IP', default='')
+# Reject writes for POLLS_SHED_SECONDS when they take longer than this many seconds on average (0 disables)
+POLLS_SHED_WRITE_LATENCY = config('POLLS_SHED_WRITE_LATENCY', default=0.0, cast=float)
+POLLS_SHED_SECONDS = config('POLLS_SHED_SECONDS', default=5, cast=int)
+
+# Most questions a search returns
+POLLS_SEARCH_MAX_RESULTS = config('POLLS_SEARCH_MAX_RESULTS', default=200, cast=int)
+
+# Admin changelists of tables with more rows than this show an estimated count
+POLLS_ADMIN_EXACT_COUNT_LIMIT = config('POLLS_ADMIN_EXACT_COUNT_LIMIT', default=10000, cast=int)
+# Most choices shown inline on the question change form
+POLLS_ADMIN_MAX_INLINES = config('POLLS_ADMIN_MAX_INLINES', default=50, cast=int)
+
+# Vote events younger than this many seconds wait for the next rollup (polls.rollups)
+POLLS_ROLLUP_DELAY = config('POLLS_ROLLUP_DELAY', default=5, cast=int)
+# Rolled up vote events are kept for this many days
+POLLS_VOTE_EVENT_RETENTION_DAYS = config('POLLS_VOTE_EVENT_RETENTION_DAYS', default=30, cast=int)
+
+# Serve the index, question and results pages the same to everyone, cacheable by shared caches for this many
+# seconds, with the per-user navbar and CSRF token fetched from polls:session (0 disables)
+POLLS_PUBLIC_CACHE_SECONDS = config('POLLS_PUBLIC_CACHE_SECONDS', default=0, cast=int)
@@ -1,15 +1,100 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.utils import model_ngettext
+from django.core.paginator import Paginator
+from django.db import connections
+from django.forms.models import BaseInlineFormSet
+from django.urls import reverse
+from django.utils.functional import cached_property
 
-from .models import Choice, Question, Profile, Comment
+from .models import Choice, Question, Profile, Comment, Vote
+from .search import filter_matching
+
+
+def estimated_count(model, using):
+    """A cheap estimate of the number of rows of `model`'s table."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+        else:
+            # Looked up in the primary key index; ids of deleted rows make it an overestimate.
+            quote = connection.ops.quote_name
+            cursor.execute(f'SELECT MAX({quote(model._meta.pk.column)}) FROM {quote(table)}')
+        row = cursor.fetchone()
+    return int(row[0] or 0) if row else 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """Estimate the count of unfiltered changelists of large tables rather than running COUNT(*)."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate > settings.POLLS_ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Don't count the whole table again next to filtered results.
+    show_full_result_count = False
+
+
+class BoundedInlineFormSet(BaseInlineFormSet):
+    """
+    Show at most `POLLS_ADMIN_MAX_INLINES` existing objects. The inline's
+    template (``BOUNDED_INLINE_TEMPLATE``) links to the rest.
+
+    The objects shown are the first ones by primary key, in the inline's
+    ordering: they have to be the same when the form is posted as when it
+    was rendered, or edits to objects that dropped out would be ignored.
+    """
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            queryset = super().get_queryset()
+            first = queryset.order_by('pk').values('pk')[: settings.POLLS_ADMIN_MAX_INLINES]
+            self._queryset = queryset.filter(pk__in=first)
+        return self._queryset
+
+    @cached_property
+    def hidden_count(self):
+        """How many existing objects aren't shown; only counted when the limit is reached."""
+        if len(self.get_queryset()) < settings.POLLS_ADMIN_MAX_INLINES:
+            return 0
+        return self.queryset.count() - settings.POLLS_ADMIN_MAX_INLINES
+
+    def hidden_label(self):
+        return f'{self.hidden_count} more {model_ngettext(self.model, self.hidden_count)}'
+
+    def changelist_url(self):
+        """The changelist of all of the objects, which the limit doesn't apply to."""
+        opts = self.model._meta
+        lookup = f'{self.fk.name}__{self.fk.target_field.name}__exact'
+        return f'{reverse(f"admin:{opts.app_label}_{opts.model_name}_changelist")}?{lookup}={self.instance.pk}'
+
+
+BOUNDED_INLINE_TEMPLATE = 'admin/edit_inline/bounded_tabular.html'
 
 
 class ChoiceInline(admin.TabularInline):
     model = Choice
+    formset = BoundedInlineFormSet
+    template = BOUNDED_INLINE_TEMPLATE
     extra = 3
-    ordering = ['-votes']
+    show_change_link = True
+
+    def get_queryset(self, request):
+        # Ordered by the votes counted in shards too, not only the compacted ones.
+        return super().get_queryset(request).with_total_votes().order_by('-total_votes', 'pk')
 
 
-class QuestionAdmin(admin.ModelAdmin):
+class QuestionAdmin(LargeTableAdmin):
     fieldsets = [
         (None, {'fields': ['question_text']}),
         ('Date information', {'fields': ['pub_date'], 'classes': ['collapse']}),
@@ -20,8 +105,56 @@ class QuestionAdmin(admin.ModelAdmin):
     search_fields = ['question_text']
     date_hierarchy = 'pub_date'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index over question texts and comments rather than LIKE scans.
+        if not search_term:
+            return queryset, False
+        return filter_matching(queryset, search_term), False
+
+
+class ChoiceAdmin(LargeTableAdmin):
+    autocomplete_fields = ['question']
+    list_display = ['choice_text', 'question', 'total_votes']
+    list_select_related = ['question']
+    search_fields = ['choice_text']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_total_votes()
+
+    def total_votes(self, obj):
+        return obj.total_votes
+
+    total_votes.admin_order_field = 'total_votes'
+    total_votes.short_description = 'votes'
+
+
+class ProfileAdmin(LargeTableAdmin):
+    autocomplete_fields = ['user']
+    list_display = ['user', 'bio']
+    list_select_related = ['user']
+    search_fields = ['user__username']
+
+
+class CommentAdmin(LargeTableAdmin):
+    autocomplete_fields = ['question']
+    list_display = ['text', 'author', 'question', 'created_date']
+    list_select_related = ['question']
+    search_fields = ['author']
+
+
+class VoteAdmin(LargeTableAdmin):
+    autocomplete_fields = ['user', 'question']
+    raw_id_fields = ['choice']
+    list_display = ['user', 'question', 'choice', 'created_date']
+    list_select_related = ['user', 'question', 'choice']
+
+    def has_delete_permission(self, request, obj=None):
+        # The vote stays counted in Choice.votes, its shards and QuestionStats.
+        return False
+
 
 admin.site.register(Question, QuestionAdmin)
-admin.site.register(Choice)
-admin.site.register(Profile)
-admin.site.register(Comment)
+admin.site.register(Choice, ChoiceAdmin)
+admin.site.register(Profile, ProfileAdmin)
+admin.site.register(Comment, CommentAdmin)
+admin.site.register(Vote, VoteAdmin)
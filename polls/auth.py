@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+
+from .cache import user_key
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    Load the user of every authenticated request, along with their profile,
+    from the cache. ``polls.signals`` drops the entry when the user or the
+    profile change and on logout.
+
+    The cached user is a whole ``User``, password hash included: the session
+    check (``get_session_auth_hash()``) and password changes need it, and a
+    user without it would blank the password if saved. So anyone who can read
+    the cache can read the hashes, as they can read the sessions of the
+    ``cached_db`` engine; keep the cache server private to the site.
+
+    ``ModelBackend`` is only listed after it for the sessions it started, so
+    credentials this backend rejects end authentication rather than being
+    hashed a second time by it.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+        if user is None and password is not None:
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        key = user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = User.objects.select_related('profile').get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            cache.set(key, user, settings.POLLS_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,24 @@
+"""Helpers shared by the benchmark commands."""
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def throwaway_database():
+    """Run the block against a new test database that is destroyed afterwards."""
+    setup_test_environment()
+    # A file rather than SQLite's in-memory test database, so that concurrent
+    # threads wait for each other's writes instead of failing.
+    tmpdir = tempfile.mkdtemp()
+    connection.settings_dict['TEST']['NAME'] = os.path.join(tmpdir, 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        os.rmdir(tmpdir)
@@ -0,0 +1,231 @@
+"""
+Write-behind buffering of vote increments.
+
+Votes are counted in memory and appended (and fsynced) to a journal per
+buffer, then flushed to ``Choice.votes`` in batched ``votes = votes + n``
+updates once a size or age threshold is crossed. Journals left behind by a
+crashed process are replayed by the next buffer that starts up (or by
+``manage.py flush_votes``).
+
+Journals are named ``votes-<pid>-<instance>-<buffer>.log``, where instance
+is random per process start: a restarted server often gets the PID of the
+one that crashed (e.g. PID 1 in a container), and must still replay its
+journals rather than take them for its own.
+"""
+import atexit
+import glob
+import os
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+from .cache import bump_question_version
+from .models import Choice, QuestionStats
+
+
+def apply_vote_counts(counts):
+    """
+    Add `counts` (a mapping of choice id to increment) to ``Choice.votes``
+    and the question stats in one transaction.
+    """
+    questions = dict(Choice.objects.filter(pk__in=counts).values_list('pk', 'question_id'))
+    with transaction.atomic():
+        for choice_id, n in sorted(counts.items()):
+            Choice.objects.filter(pk=choice_id).update(votes=F('votes') + n)
+        # Only now that the votes are in the totals, see the vote_cast receivers.
+        for choice_id, n in sorted(counts.items()):
+            if choice_id in questions:
+                QuestionStats.record_vote(questions[choice_id], choice_id, n)
+    bump_question_version(*set(questions.values()))
+
+
+# Tells this process apart from earlier ones that had the same PID.
+INSTANCE = uuid.uuid4().hex[:8]
+
+
+def read_journal(path):
+    with open(path) as f:
+        return Counter(int(line) for line in f if line.strip())
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _owner_alive(owner):
+    """Whether the process that wrote or claimed a journal, "<pid>[-<instance>]", is still running."""
+    pid, _, instance = owner.partition('-')
+    if int(pid) == os.getpid():
+        return instance == INSTANCE
+    return _pid_alive(int(pid))
+
+
+def recover_journals(journal_dir, apply=apply_vote_counts):
+    """
+    Replay journals of processes that are no longer running and return the
+    number of votes recovered. Each file is claimed with an atomic rename
+    first, so concurrent recoveries never apply the same journal twice.
+    """
+    recovered = 0
+    for path in glob.glob(os.path.join(journal_dir, 'votes-*')):
+        if path.endswith('.claimed'):
+            # Claimed by a recovery that may itself have crashed.
+            owner = path.split('.')[-2]
+        else:
+            # votes-<pid>-<instance>-<buffer>.log, or votes-<pid>.log from before instances.
+            owner = '-'.join(os.path.basename(path).split('.')[0].split('-')[1:3])
+        if _owner_alive(owner):
+            continue
+        claimed = f'{path}.{os.getpid()}-{INSTANCE}.claimed'
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue
+        counts = read_journal(claimed)
+        apply(counts)
+        os.remove(claimed)
+        recovered += sum(counts.values())
+    return recovered
+
+
+class VoteBuffer:
+    def __init__(self, journal_dir, max_votes=100, max_age=5.0, apply=apply_vote_counts):
+        self.journal_dir = journal_dir
+        self.max_votes = max_votes
+        self.max_age = max_age
+        self.apply = apply
+        self.token = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        # Flushes write one at a time, rather than contend for the database's write lock.
+        self._apply_lock = threading.Lock()
+        self._counts = Counter()
+        self._pending = 0
+        self._journal = None
+        self._timer = None
+        self._rotations = 0
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.journal_dir, f'votes-{os.getpid()}-{INSTANCE}-{self.token}.log')
+
+    def add(self, choice_id, flush=True):
+        """
+        Journal and count a vote. With `flush` false, a full buffer is left
+        for ``flush_if_full()``, e.g. to journal inside a transaction.
+        """
+        with self._lock:
+            if self._journal is None:
+                os.makedirs(self.journal_dir, exist_ok=True)
+                self._journal = open(self.journal_path, 'a')
+            position = self._journal.tell()
+            try:
+                self._journal.write(f'{choice_id}\n')
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            except OSError:
+                # The vote is rolled back, so recoveries must not replay it.
+                self._journal.truncate(position)
+                raise
+            self._counts[choice_id] += 1
+            self._pending += 1
+            self._schedule()
+        if flush:
+            self.flush_if_full()
+
+    def flush_if_full(self):
+        with self._lock:
+            full = self._pending >= self.max_votes
+        if full:
+            self.flush()
+
+    def _schedule(self):
+        """Start the timer flushing the buffer after `max_age` seconds; call with the lock held."""
+        if self._timer is None and self.max_age and self._pending:
+            self._timer = threading.Timer(self.max_age, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self):
+        try:
+            self.flush()
+        finally:
+            # Nothing else closes the connections of the timer's thread.
+            connections.close_all()
+
+    def pending(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def flush(self):
+        """Apply the buffered increments and return how many votes were written."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return 0
+            counts = self._counts
+            batch = self._rotate()
+            self._counts = Counter()
+            self._pending = 0
+        try:
+            with self._apply_lock:
+                self.apply(counts)
+        except Exception:
+            self._restore(counts, batch)
+            raise
+        os.remove(batch)
+        return sum(counts.values())
+
+    def _rotate(self):
+        self._journal.close()
+        self._journal = None
+        self._rotations += 1
+        batch = f'{self.journal_path}.{self._rotations}.pending'
+        os.rename(self.journal_path, batch)
+        return batch
+
+    def _restore(self, counts, batch):
+        """Return a batch that failed to apply to the buffer and its journal."""
+        with self._lock:
+            with open(batch) as src, open(self.journal_path, 'a') as dst:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(batch)
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = open(self.journal_path, 'a')
+            self._counts.update(counts)
+            self._pending += sum(counts.values())
+            # Try again later, even if no more votes come in.
+            self._schedule()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """Return the process-wide buffer, replaying orphaned journals on first use."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            recover_journals(settings.POLLS_VOTE_JOURNAL_DIR)
+            _buffer = VoteBuffer(
+                settings.POLLS_VOTE_JOURNAL_DIR,
+                max_votes=settings.POLLS_VOTE_BUFFER_SIZE,
+                max_age=settings.POLLS_VOTE_BUFFER_INTERVAL,
+            )
+            atexit.register(_buffer.flush)
+        return _buffer
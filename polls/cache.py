@@ -0,0 +1,84 @@
+"""
+Versioned cache keys for question pages and the index page.
+
+Every question has a version number in the cache that is bumped whenever
+anything shown on its pages changes (see ``polls.signals``), and so does the
+index. Keys embed the version, so stale entries are never read again and
+simply expire. Versions are the time of the change in nanoseconds, so they
+double as modification times.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+INDEX_VERSION_KEY = 'polls:index:version'
+
+
+def _version_key(question_id):
+    return f'polls:question:{question_id}:version'
+
+
+def version_timeout():
+    """Versions outlive the entries cached under them, but do expire: a restarted version only means a cache miss."""
+    return settings.POLLS_CACHE_TIMEOUT * 10
+
+
+def question_version(question_id):
+    return question_versions([question_id]).get(question_id)
+
+
+def question_versions(question_ids):
+    """Return the versions of those of `question_ids` that have one."""
+    keys = {_version_key(question_id): question_id for question_id in question_ids}
+    return {keys[key]: version for key, version in cache.get_many(keys).items()}
+
+
+def start_question_versions(question_ids, version):
+    """
+    Give the questions without a version `version`, which should be taken
+    before reading them, and return the versions of all of them. Only call
+    this for questions that exist, so that requests for made up ids leave no
+    keys behind.
+    """
+    keys = {_version_key(question_id): question_id for question_id in question_ids}
+    for key in keys:
+        cache.add(key, version, version_timeout())
+    return {keys[key]: version for key, version in cache.get_many(keys).items()}
+
+
+def bump_question_version(*question_ids):
+    cache.set_many({_version_key(question_id): time.time_ns() for question_id in question_ids}, version_timeout())
+
+
+def question_key(question_id, version, *parts):
+    return ':'.join(['polls:question', str(question_id), str(version), *map(str, parts)])
+
+
+def get_or_set(key, default):
+    """Like ``cache.get_or_set`` but with the polls timeout."""
+    return cache.get_or_set(key, default, settings.POLLS_CACHE_TIMEOUT)
+
+
+def voted_key(user_id):
+    """Key of the set of question ids the user has voted on."""
+    return f'polls:user:{user_id}:voted'
+
+
+def user_key(user_id):
+    """Key of the user record, with their profile, of authenticated requests."""
+    return f'polls:user:{user_id}:record'
+
+
+def index_version():
+    """Return the version of the index page, starting one if needed; take it before reading the questions."""
+    cache.add(INDEX_VERSION_KEY, time.time_ns(), version_timeout())
+    return cache.get(INDEX_VERSION_KEY)
+
+
+def index_key(version):
+    return f'polls:index:{version}'
+
+
+def invalidate_index():
+    cache.set(INDEX_VERSION_KEY, time.time_ns(), version_timeout())
@@ -4,17 +4,36 @@ from .models import Comment
 
 
 class CommentForm(forms.ModelForm):
+    """
+    The question isn't a form field: it comes from the URL, so that rendering
+    the form doesn't list every question.
+    """
+
+    autofocus = True
+
     class Meta:
         model = Comment
-        fields = ['question', 'created_date', 'author', 'text']
+        fields = ['created_date', 'author', 'text']
 
-    def __init__(self, question_pk=None, username=None, *args, **kwargs):
+    def __init__(self, username=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['text'].widget.attrs['autofocus'] = True
-
-        if question_pk:
-            self.fields['question'].initial = question_pk
-            self.fields['question'].disabled = True
+        if self.autofocus:
+            self.fields['text'].widget.attrs['autofocus'] = True
         if username:
             self.fields['author'].initial = username
-        self.fields['created_date'].disabled = True
+        if 'created_date' in self.fields:
+            self.fields['created_date'].disabled = True
+
+
+class InlineCommentForm(CommentForm):
+    """
+    The comment form below the question's choices: it doesn't take the focus
+    away from voting, and leaves out the date, which would make the page
+    differ on every render.
+    """
+
+    autofocus = False
+
+    class Meta(CommentForm.Meta):
+        fields = ['author', 'text']
+        widgets = {'text': forms.Textarea(attrs={'rows': 3})}
@@ -0,0 +1,175 @@
+"""
+Live results over Server-Sent Events.
+
+Votes are published to a broker as the vote view records them (see
+``polls.signals``), and ``LiveResultsApp``, mounted in ``mysite.asgi``,
+streams them to everyone watching a question's results. Bursts of votes are
+coalesced into one ``{choice_id: votes_added}`` event per interval.
+
+``LocalBroker`` only reaches clients connected to the same process. With
+several workers, plug in a broker backed by a shared pub/sub service through
+``POLLS_LIVE_BROKER``.
+"""
+import abc
+import asyncio
+import json
+import threading
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from django.utils.module_loading import import_string
+
+from .models import Question
+
+LIVE_SUFFIX = 'live/'
+HEARTBEAT_INTERVAL = 15
+
+
+class Broker(abc.ABC):
+    """Interface of the pub/sub layer between the vote view and live streams."""
+
+    @abc.abstractmethod
+    def publish(self, question_id, choice_id):
+        """Announce a vote. Must be safe to call from any thread."""
+
+    @abc.abstractmethod
+    def subscribe(self, question_id):
+        """Return an ``asyncio.Queue`` that receives the choice ids voted for."""
+
+    @abc.abstractmethod
+    def unsubscribe(self, question_id, queue):
+        """Stop delivering votes to a queue returned by ``subscribe()``."""
+
+
+class LocalBroker(Broker):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, question_id, choice_id):
+        with self._lock:
+            subscribers = list(self._subscribers.get(question_id, {}).items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, choice_id)
+            except RuntimeError:
+                # The subscriber's event loop has been closed.
+                pass
+
+    def subscribe(self, question_id):
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(question_id, {})[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, question_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(question_id, {})
+            subscribers.pop(queue, None)
+            if not subscribers:
+                self._subscribers.pop(question_id, None)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.POLLS_LIVE_BROKER)()
+    return _broker
+
+
+def live_question_id(scope):
+    """
+    Return the id of the question whose stream `scope` asks for, or None.
+    Streams are served at the question page's URL, as routed by the URLconf,
+    followed by ``live/``.
+    """
+    if scope['type'] != 'http' or not scope['path'].endswith(LIVE_SUFFIX):
+        return None
+    path = scope['path']
+    root_path = scope.get('root_path', '')
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    try:
+        match = resolve(path[: -len(LIVE_SUFFIX)])
+    except Resolver404:
+        return None
+    return match.kwargs['pk'] if match.view_name == 'polls:question' else None
+
+
+@sync_to_async
+def is_visible(question_id):
+    return Question.objects.visible().filter(pk=question_id).exists()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class LiveResultsApp:
+    """
+    ASGI middleware serving ``/polls/<pk>/live/`` (see ``live_question_id()``)
+    as an event stream and passing every other request on to `app`.
+    """
+
+    def __init__(self, app, broker=None):
+        self.app = app
+        self.broker = broker
+        self.connections = 0
+
+    async def __call__(self, scope, receive, send):
+        question_id = live_question_id(scope)
+        if question_id is None:
+            return await self.app(scope, receive, send)
+
+        if self.connections >= settings.POLLS_LIVE_MAX_CONNECTIONS:
+            return await self.respond(send, 503, b'Too many live connections', [(b'retry-after', b'30')])
+        self.connections += 1
+        try:
+            if not await is_visible(question_id):
+                return await self.respond(send, 404, b'No question found matching the query')
+            await self.stream(question_id, receive, send)
+        finally:
+            self.connections -= 1
+
+    async def stream(self, question_id, receive, send):
+        broker = self.broker or get_broker()
+        queue = broker.subscribe(question_id)
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            headers = [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')]
+            await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+            while True:
+                vote = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {vote, disconnected}, timeout=HEARTBEAT_INTERVAL, return_when=asyncio.FIRST_COMPLETED
+                )
+                if vote not in done:
+                    vote.cancel()
+                    if disconnected in done:
+                        break
+                    await send({'type': 'http.response.body', 'body': b': heartbeat\n\n', 'more_body': True})
+                    continue
+
+                # Let a burst of votes pile up and send it as a single event.
+                votes = Counter([vote.result()])
+                await asyncio.sleep(settings.POLLS_LIVE_COALESCE_INTERVAL)
+                while not queue.empty():
+                    votes[queue.get_nowait()] += 1
+                event = f'event: votes\ndata: {json.dumps(votes)}\n\n'
+                await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+        finally:
+            disconnected.cancel()
+            broker.unsubscribe(question_id, queue)
+
+    @staticmethod
+    async def respond(send, status, body, headers=()):
+        headers = [(b'content-type', b'text/plain'), *headers]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
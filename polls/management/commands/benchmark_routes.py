@@ -0,0 +1,202 @@
+import datetime
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from polls import urls
+from polls.benchmark import throwaway_database
+from polls.models import Choice, Comment, Profile, Question
+
+
+# Routes requested as `route_user()` rather than as the staff user.
+PER_USER_ROUTES = {'vote'}
+
+
+def route_user(data, i):
+    return data['users'][i % len(data['users'])]
+
+
+def route_requests(data, i):
+    """Return (method, url, post data) of the i-th request for every named route in ``polls.urls``."""
+    question = data['questions'][i % len(data['questions'])]
+    user = route_user(data, i)
+    # Users vote once per question, so give each request a new (user, question) pair.
+    vote_question = data['questions'][i // len(data['users']) % len(data['questions'])]
+    return {
+        'index': ('get', reverse('polls:index'), None),
+        'question': ('get', reverse('polls:question', args=[question]), None),
+        'results': ('get', reverse('polls:results', args=[question]), None),
+        'vote': ('post', reverse('polls:vote', args=[vote_question]), {'choice': data['choices'][vote_question][0]}),
+        'user_list': ('get', reverse('polls:user_list'), None),
+        'user': ('get', reverse('polls:user', args=[user]), None),
+        'add_comment': (
+            'post',
+            reverse('polls:add_comment', args=[question]),
+            {'author': 'bench', 'text': 'Benchmark comment'},
+        ),
+        'comments': ('get', reverse('polls:comments', args=[question]), None),
+        'trends': ('get', reverse('polls:trends', args=[question]), None),
+        'results_api': ('get', reverse('polls:results_api'), {'ids': ','.join(map(str, data['questions'][:20]))}),
+        'export': ('get', reverse('polls:export', args=['results']), None),
+        'stats': ('get', reverse('polls:stats'), None),
+        'search': ('get', reverse('polls:search'), {'q': f'question {i % 100}'}),
+        'session': ('get', reverse('polls:session'), None),
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[round(p / 100 * (len(values) - 1))]
+
+
+class Command(BaseCommand):
+    help = """
+    Seed a throwaway database with synthetic polls and measure latency,
+    throughput and query counts of every route in polls.urls. With
+    --baseline, fail when a route got slower or needs more queries than
+    recorded in the baseline file.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=200)
+        parser.add_argument('--choices', type=int, default=4, help='Choices per question')
+        parser.add_argument('--comments', type=int, default=20, help='Comments per question')
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=100, help='Requests per route')
+        parser.add_argument('--workers', type=int, default=1, help='Concurrent clients')
+        parser.add_argument('--routes', nargs='*', help='Only benchmark these routes')
+        parser.add_argument('--baseline', help='JSON file with the results to compare with')
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results to --baseline')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25, help='Allowed relative p95 latency regression'
+        )
+
+    def handle(self, *args, **options):
+        names = [pattern.name for pattern in urls.urlpatterns if pattern.name]
+        missing = set(names) - set(route_requests({'questions': [1], 'choices': {1: [1]}, 'users': [1]}, 0))
+        if missing:
+            raise CommandError(f'No benchmark request defined for routes {sorted(missing)}')
+        names = options['routes'] or names
+
+        # Keep the synthetic data out of a cache that may be shared with the site,
+        # and let all requests through although they come from one address.
+        with override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            POLLS_RATE_LIMIT_USER='',
+            POLLS_RATE_LIMIT_IP='',
+            POLLS_SHED_WRITE_LATENCY=0,
+        ):
+            results = self.benchmark(names, options)
+
+        self.report(results)
+        if options['baseline'] and options['save_baseline']:
+            with open(options['baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        elif options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def benchmark(self, names, options):
+        with throwaway_database():
+            data = self.seed(options)
+            results = {name: self.run(name, data, options) for name in names}
+        return results
+
+    def seed(self, options):
+        now = timezone.now()
+        questions = Question.objects.bulk_create(
+            Question(question_text=f'Question {i}', pub_date=now - datetime.timedelta(minutes=i))
+            for i in range(options['questions'])
+        )
+        question_ids = list(Question.objects.values_list('pk', flat=True))
+        Choice.objects.bulk_create(
+            Choice(question_id=pk, choice_text=f'Choice {i}') for pk in question_ids for i in range(options['choices'])
+        )
+        Comment.objects.bulk_create(
+            Comment(question_id=pk, author='seed', text=f'Comment {i}')
+            for pk in question_ids
+            for i in range(options['comments'])
+        )
+        password = make_password('benchmark')
+        User.objects.bulk_create(
+            User(username=f'user{i}', password=password, is_staff=i == 0) for i in range(options['users'])
+        )
+        user_ids = list(User.objects.values_list('pk', flat=True))
+        Profile.objects.bulk_create(Profile(user_id=pk) for pk in user_ids)
+
+        choices = {}
+        for question_id, choice_id in Choice.objects.values_list('question_id', 'pk'):
+            choices.setdefault(question_id, []).append(choice_id)
+        self.stdout.write(f'Seeded {len(questions)} questions and {len(user_ids)} users')
+        return {'questions': question_ids, 'choices': choices, 'users': user_ids}
+
+    def run(self, name, data, options):
+        latencies = []
+        queries = []
+        lock = threading.Lock()
+
+        def worker(indexes):
+            client = Client()
+            client.force_login(User.objects.get(pk=data['users'][0]))
+            for i in indexes:
+                if name in PER_USER_ROUTES:
+                    client.force_login(User.objects.get(pk=route_user(data, i)))
+                method, url, params = route_requests(data, i)[name]
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = getattr(client, method)(url, params)
+                    elapsed = time.perf_counter() - start
+                if response.status_code >= 400:
+                    raise CommandError(f'{name}: {url} returned {response.status_code}')
+                with lock:
+                    latencies.append(elapsed)
+                    queries.append(len(captured))
+            connection.close()
+
+        worker([-1])  # warm up
+        latencies.clear()
+        queries.clear()
+        workers = options['workers']
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as executor:
+            for future in [executor.submit(worker, range(w, options['requests'], workers)) for w in range(workers)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+        return {
+            'p50': percentile(latencies, 50) * 1000,
+            'p95': percentile(latencies, 95) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'rps': len(latencies) / elapsed,
+            'queries': max(queries),
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"route":<12} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} {"queries":>8}')
+        for name, r in results.items():
+            self.stdout.write(
+                f'{name:<12} {r["p50"]:8.2f} {r["p95"]:8.2f} {r["p99"]:8.2f} {r["rps"]:8.1f} {r["queries"]:8d}'
+            )
+
+    def compare(self, results, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, r in results.items():
+            if name not in baseline:
+                continue
+            if r['p95'] > baseline[name]['p95'] * (1 + tolerance):
+                regressions.append(f'{name}: p95 {r["p95"]:.2f}ms, baseline {baseline[name]["p95"]:.2f}ms')
+            if r['queries'] > baseline[name]['queries']:
+                regressions.append(f'{name}: {r["queries"]} queries, baseline {baseline[name]["queries"]}')
+        if regressions:
+            raise CommandError('Regressions:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions'))
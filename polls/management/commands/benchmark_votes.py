@@ -0,0 +1,59 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import F
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from polls.benchmark import throwaway_database
+from polls.models import Choice, ChoiceShard, Question
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent single-row vote updates with sharded vote counters in a throwaway database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--votes', type=int, default=500, help='Votes per thread')
+        parser.add_argument('--shards', type=int, default=16)
+
+    def handle(self, *args, **options):
+        # Keep the question out of the site's database and of a cache that may be shared with it.
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            single, sharded, total = self.benchmark(options)
+
+        expected = 2 * options['threads'] * options['votes']
+        self.stdout.write(f'single row: {single:10.1f} votes/s')
+        self.stdout.write(f'{options["shards"]:3d} shards: {sharded:10.1f} votes/s')
+        if total != expected:
+            self.stderr.write(f'Lost votes: counted {total} of {expected}')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'All {expected} votes counted'))
+
+    def benchmark(self, options):
+        with throwaway_database():
+            question = Question.objects.create(question_text='Vote benchmark', pub_date=timezone.now())
+            choice = Choice.objects.create(question=question, choice_text='Hot choice')
+            single = self.run(options, lambda: Choice.objects.filter(pk=choice.pk).update(votes=F('votes') + 1))
+            sharded = self.run(options, lambda: ChoiceShard.increment(choice.pk, options['shards']))
+            total = Choice.objects.with_total_votes().get(pk=choice.pk).total_votes
+        return single, sharded, total
+
+    @staticmethod
+    def run(options, vote):
+        def worker():
+            try:
+                for _ in range(options['votes']):
+                    vote()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return options['threads'] * options['votes'] / (time.perf_counter() - start)
@@ -0,0 +1,31 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = """
+    Delete expired sessions from the database in batches, unlike
+    clearsessions, so that the session table isn't locked for long.
+    Cached copies expire on their own.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to wait between batches')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted = 0
+        while True:
+            keys = list(
+                Session.objects.filter(expire_date__lt=now).values_list('pk', flat=True)[: options['batch_size']]
+            )
+            if not keys:
+                break
+            deleted += Session.objects.filter(pk__in=keys).delete()[0]
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired sessions'))
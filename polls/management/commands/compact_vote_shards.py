@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import ChoiceShard
+
+
+class Command(BaseCommand):
+    help = 'Fold sharded vote counters back into Choice.votes.'
+
+    def handle(self, *args, **options):
+        moved = ChoiceShard.compact()
+        self.stdout.write(self.style.SUCCESS(f'Compacted {moved} votes'))
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.export import EXPORTS, FORMATS, parse_bound, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Stream poll results or comments as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--since', help='Only questions published at or after this date')
+        parser.add_argument('--until', help='Only questions published before this date')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('-o', '--output', help='Output file, defaults to stdout')
+
+    def handle(self, *args, **options):
+        try:
+            since, until = parse_bound(options['since']), parse_bound(options['until'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        chunks = stream_export(options['kind'], options['format'], since, until, options['gzip'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from polls.buffer import recover_journals
+
+
+class Command(BaseCommand):
+    help = 'Replay vote journals left behind by stopped or crashed processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--journal-dir', default=settings.POLLS_VOTE_JOURNAL_DIR)
+
+    def handle(self, *args, **options):
+        recovered = recover_journals(options['journal_dir'])
+        self.stdout.write(self.style.SUCCESS(f'Recovered {recovered} buffered votes'))
@@ -0,0 +1,151 @@
+import csv
+import datetime
+import json
+import os
+import time
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from polls.cache import bump_question_version, invalidate_index
+from polls.models import Checkpoint, Choice, Comment, Question, QuestionStats
+
+MODELS = {'question': Question, 'choice': Choice, 'comment': Comment}
+
+
+class Command(BaseCommand):
+    help = """
+    Stream questions, choices and comments into the database with bulk inserts.
+
+    JSONL input has one object per line with a "model" key ("question",
+    "choice" or "comment") and field values, e.g.
+    {"model": "choice", "question": 1, "choice_text": "Yes"}. CSV input holds
+    a single model, given with --model, and has field names in its header.
+    Choices and comments refer to questions by id, so questions need an
+    explicit "id" and must come before their choices and comments.
+
+    With --checkpoint NAME, progress is saved in the database in the same
+    transaction as each batch, and rerunning with the same NAME resumes
+    after the last committed batch.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='Defaults to the file extension')
+        parser.add_argument('--model', choices=sorted(MODELS), help='Model of the rows of a CSV file')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--checkpoint', help='Name to save progress under, so that an interrupted import can be resumed'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        if fmt not in ('jsonl', 'csv'):
+            raise CommandError('Unknown format, use --format jsonl or --format csv')
+        if fmt == 'csv' and not options['model']:
+            raise CommandError('--model is required for CSV input')
+
+        self.verbosity = options['verbosity']
+        self.checkpoint = options['checkpoint'] and f'import:{options["checkpoint"]}'
+        if self.checkpoint and len(self.checkpoint) > Checkpoint._meta.get_field('name').max_length:
+            raise CommandError('--checkpoint is too long')
+        done = self.read_checkpoint()
+        if done:
+            self.stdout.write(f'Resuming after {done} rows')
+
+        self.start = time.perf_counter()
+        self.imported = 0
+        batch = []
+        with open(path, newline='') as f:
+            for number, record in enumerate(self.records(f, fmt, options['model']), 1):
+                if number <= done:
+                    continue
+                batch.append((number, record))
+                if len(batch) >= options['batch_size']:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+
+        if self.checkpoint:
+            Checkpoint.objects.filter(name=self.checkpoint).delete()
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Imported {self.imported} rows in {elapsed:.1f}s ({self.imported / elapsed:.0f} rows/s)'
+            )
+        )
+
+    @staticmethod
+    def records(f, fmt, model):
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                yield dict(row, model=model)
+        else:
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError as e:
+                        raise CommandError(f'Invalid JSON: {e}')
+
+    def import_batch(self, batch):
+        objects = {name: [] for name in MODELS}
+        for number, record in batch:
+            name = record.pop('model', None)
+            if name not in MODELS:
+                raise CommandError(f'Row {number}: unknown model {name!r}')
+            try:
+                obj = build(MODELS[name], record)
+            except (FieldDoesNotExist, ValidationError, ValueError) as e:
+                raise CommandError(f'Row {number}: {e}')
+            if name == 'question' and obj.pk is None:
+                # bulk_create() doesn't return ids on every database, and the stats and caches need them.
+                raise CommandError(f'Row {number}: questions need an id')
+            objects[name].append(obj)
+
+        # Check question references with one query rather than one per row.
+        new_ids = {question.pk for question in objects['question']}
+        referenced = {obj.question_id for obj in objects['choice'] + objects['comment']}
+        missing = referenced - new_ids - set(Question.objects.filter(pk__in=referenced).values_list('pk', flat=True))
+        if missing:
+            raise CommandError(f'Rows {batch[0][0]}-{batch[-1][0]} refer to missing questions {sorted(missing)}')
+
+        with transaction.atomic():
+            for name, model in MODELS.items():
+                model.objects.bulk_create(objects[name])
+            # Committed with the rows, so a resumed import neither skips nor repeats any.
+            self.write_checkpoint(batch[-1][0])
+        # bulk_create() sends no signals, so invalidate the cached pages and count here.
+        bump_question_version(*new_ids, *referenced)
+        invalidate_index()
+        QuestionStats.reconcile(new_ids | referenced)
+
+        self.imported += len(batch)
+        if self.verbosity > 1:
+            rate = self.imported / (time.perf_counter() - self.start)
+            self.stdout.write(f'{batch[-1][0]} rows, {rate:.0f} rows/s')
+
+    def read_checkpoint(self):
+        if not self.checkpoint:
+            return 0
+        return Checkpoint.objects.filter(name=self.checkpoint).values_list('last_id', flat=True).first() or 0
+
+    def write_checkpoint(self, rows):
+        if self.checkpoint:
+            Checkpoint.objects.update_or_create(name=self.checkpoint, defaults={'last_id': rows})
+
+
+def build(model, record):
+    """Return an unsaved `model` instance from raw field values."""
+    values = {}
+    for name, value in record.items():
+        field = model._meta.get_field(name)
+        value = field.to_python(value)
+        if isinstance(value, datetime.datetime) and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        values[field.attname] = value
+    return model(**values)
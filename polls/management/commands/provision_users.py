@@ -0,0 +1,69 @@
+import csv
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from polls.provisioning import USER_FIELDS, provision_users
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = f"""
+    Create users from a CSV file with a header of "username", "password" and
+    optionally {", ".join(f'"{field}"' for field in USER_FIELDS)} and "bio", hashing
+    passwords in parallel. With --compare, also time creating the first rows one
+    by one with create_user() (rolled back afterwards).
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, help='Hashing processes, defaults to one per CPU')
+        parser.add_argument('--compare', type=int, default=0, metavar='N', help='Time create_user() for N rows')
+
+    def handle(self, *args, **options):
+        with open(options['path'], newline='') as f:
+            rows = [self.parse(row) for row in csv.DictReader(f)]
+        if not rows:
+            self.stdout.write('No users to provision')
+            return
+
+        if options['compare']:
+            sample = rows[: options['compare']]
+            rate = self.time_create_user(sample)
+            self.stdout.write(f'create_user(): {len(sample)} users, {rate:.1f} users/s')
+
+        start = time.perf_counter()
+        try:
+            created = provision_users(rows, options['batch_size'], options['workers'])
+        except ValueError as e:
+            raise CommandError(e)
+        rate = created / (time.perf_counter() - start)
+        self.stdout.write(self.style.SUCCESS(f'Provisioned {created} users, {rate:.1f} users/s'))
+
+    @staticmethod
+    def parse(row):
+        row = {key: value for key, value in row.items() if value != ''}
+        if 'is_staff' in row:
+            row['is_staff'] = row['is_staff'].lower() in ('1', 'true', 'yes')
+        row.setdefault('password', None)
+        return row
+
+    @staticmethod
+    def time_create_user(rows):
+        start = time.perf_counter()
+        try:
+            with transaction.atomic():
+                for row in rows:
+                    fields = {field: row[field] for field in USER_FIELDS if field in row}
+                    User.objects.create_user(row['username'], password=row['password'], **fields)
+                elapsed = time.perf_counter() - start
+                raise Rollback
+        except Rollback:
+            pass
+        return len(rows) / elapsed
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of questions and comments from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if not rebuild_search_index(options['database']):
+            raise CommandError('Full-text search needs SQLite with FTS5, searches use LIKE lookups instead')
+        self.stdout.write(self.style.SUCCESS('Rebuilt the search index'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import Question, QuestionStats
+
+
+class Command(BaseCommand):
+    help = 'Recompute QuestionStats from the choice, comment and vote tables and repair rows that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        ids = Question.objects.order_by('pk').values_list('pk', flat=True)
+        repaired = checked = 0
+        batch_size = options['batch_size']
+        last = 0
+        while True:
+            batch = list(ids.filter(pk__gt=last)[:batch_size])
+            if not batch:
+                break
+            repaired += QuestionStats.reconcile(batch)
+            checked += len(batch)
+            last = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} questions, repaired {repaired}'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from polls.rollups import prune_vote_events, rollup_votes
+
+
+class Command(BaseCommand):
+    help = """
+    Aggregate new vote events into hourly and daily rollups. Run it
+    periodically, e.g. every minute from cron. With --prune, also delete
+    rolled up events older than POLLS_VOTE_EVENT_RETENTION_DAYS.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--prune', action='store_true')
+
+    def handle(self, *args, **options):
+        rolled_up = rollup_votes(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {rolled_up} vote events'))
+        if options['prune']:
+            pruned = prune_vote_events(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Pruned {pruned} vote events'))
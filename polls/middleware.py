@@ -0,0 +1,185 @@
+"""
+Lightweight request instrumentation that is cheap enough for production.
+
+With `POLLS_INSTRUMENTATION` on, ``InstrumentationMiddleware`` measures SQL
+time and query count, template rendering time and total time of every
+request and aggregates them into per-route histograms (see the
+``polls:stats`` view). Requests from `INTERNAL_IPS` also get them in a
+``Server-Timing`` header; behind a reverse proxy, that is whoever the proxy's
+address is listed for. A `POLLS_PROFILE_SAMPLE_RATE` fraction of requests is
+also run under cProfile.
+
+``PrimaryPinningMiddleware`` decides which requests may read from replicas,
+see ``polls.routers``.
+"""
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+from . import routers
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, float('inf')]
+
+
+class RouteStats:
+    def __init__(self, profiles=20):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self.profiles = deque(maxlen=profiles)
+
+    def record(self, route, duration, queries):
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = {
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'queries': 0,
+                    'buckets': [0] * len(BUCKETS),
+                }
+            stats['count'] += 1
+            stats['total_ms'] += duration
+            stats['queries'] += queries
+            stats['buckets'][next(i for i, bound in enumerate(BUCKETS) if duration <= bound)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            routes = {route: dict(stats, buckets=list(stats['buckets'])) for route, stats in self._routes.items()}
+            profiles = list(self.profiles)
+        for stats in routes.values():
+            stats['mean_ms'] = stats['total_ms'] / stats['count']
+            stats['p50_ms'] = self.quantile(stats, 0.5)
+            stats['p95_ms'] = self.quantile(stats, 0.95)
+        return {'buckets_ms': [str(bound) for bound in BUCKETS], 'routes': routes, 'profiles': profiles}
+
+    @staticmethod
+    def quantile(stats, q):
+        """Upper bound of the bucket holding the q-quantile."""
+        seen = 0
+        for bound, count in zip(BUCKETS, stats['buckets']):
+            seen += count
+            if seen >= q * stats['count']:
+                return bound
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self.profiles.clear()
+
+
+route_stats = RouteStats()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper, see ``connection.execute_wrapper()``."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.POLLS_INSTRUMENTATION:
+            return self.get_response(request)
+
+        timings = request.timings = RequestTimings()
+        profiler = None
+        if random.random() < settings.POLLS_PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timings))
+            if profiler:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+        total = (time.perf_counter() - start) * 1000
+
+        if request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS:
+            db, template = timings.db * 1000, timings.template * 1000
+            response['Server-Timing'] = ', '.join(
+                [
+                    f'db;dur={db:.1f};desc="{timings.queries} queries"',
+                    f'tpl;dur={template:.1f}',
+                    f'view;dur={total - template:.1f}',
+                    f'total;dur={total:.1f}',
+                ]
+            )
+        match = request.resolver_match
+        route = match.view_name if match else 'unresolved'
+        route_stats.record(route, total, timings.queries)
+        if profiler:
+            route_stats.profiles.append({'route': route, 'path': request.path, 'stats': format_profile(profiler)})
+        return response
+
+    def process_template_response(self, request, response):
+        # Render here, as the last template response hook, to time rendering.
+        timings = getattr(request, 'timings', None)
+        if timings is not None:
+            start = time.perf_counter()
+            response.render()
+            timings.template += time.perf_counter() - start
+        return response
+
+
+def format_profile(profiler, limit=25):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+PIN_COOKIE = 'polls_primary'
+
+
+class PrimaryPinningMiddleware:
+    """
+    Read from the primary in requests that may write (unsafe methods, the
+    admin) and for `POLLS_DB_PIN_SECONDS` after a client wrote something.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.POLLS_DB_REPLICAS:
+            return self.get_response(request)
+
+        pinned = (
+            PIN_COOKIE in request.COOKIES
+            or request.method not in ('GET', 'HEAD', 'OPTIONS')
+            or request.path.startswith(reverse('admin:index'))
+        )
+        state, token = routers.start_request(pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.end_request(token)
+        if state.wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.POLLS_DB_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
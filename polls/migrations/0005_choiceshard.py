@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-16 20:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_comment'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='choice',
+            options={'ordering': ['-votes']},
+        ),
+        migrations.CreateModel(
+            name='ChoiceShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('votes', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='polls.choice')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='choiceshard',
+            constraint=models.UniqueConstraint(fields=('choice', 'index'), name='unique_choice_shard'),
+        ),
+    ]
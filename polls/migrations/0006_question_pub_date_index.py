@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-16 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_choiceshard'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='question',
+            name='pub_date',
+            field=models.DateTimeField(db_index=True, verbose_name='date published'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.1.14 on 2026-10-16 20:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_question_pub_date_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='question',
+            name='pub_date',
+            field=models.DateTimeField(verbose_name='date published'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['question', 'created_date', 'id'], name='polls_comme_questio_fd6db7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['pub_date', 'id'], name='polls_quest_pub_dat_306bbb_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.14 on 2026-10-16 20:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_vote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionStats',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='polls.question')),
+                ('total_votes', models.IntegerField(default=0)),
+                ('leader_votes', models.IntegerField(default=0)),
+                ('choice_count', models.IntegerField(default=0)),
+                ('comment_count', models.IntegerField(default=0)),
+                ('last_activity', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'question stats',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='choice',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='choice',
+            index=models.Index(fields=['question', '-votes'], name='choice_question_votes_idx'),
+        ),
+        migrations.AddField(
+            model_name='questionstats',
+            name='leader',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='polls.choice'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-16 21:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_vote_events'),
+    ]
+
+    operations = [
+        migrations.RenameModel(
+            old_name='RollupWatermark',
+            new_name='Checkpoint',
+        ),
+    ]
@@ -1,16 +1,33 @@
 import datetime
+import random
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, Exists, F, Max, OuterRef, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
 
 
+class QuestionQuerySet(models.QuerySet):
+    def with_has_choices(self):
+        return self.annotate(has_choices=Exists(Choice.objects.filter(question=OuterRef('pk'))))
+
+    def visible(self):
+        """Questions that are published and have choices, i.e. not `is_hidden()`."""
+        return self.with_has_choices().filter(pub_date__lte=timezone.now(), has_choices=True)
+
+
 class Question(models.Model):
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published')
 
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['pub_date', 'id'])]
+
     def was_published_recently(self):
         now = timezone.now()
         return now - datetime.timedelta(days=1) <= self.pub_date <= now
@@ -20,24 +37,233 @@ class Question(models.Model):
     was_published_recently.short_description = 'Published recently?'
 
     def is_hidden(self):
-        return self.pub_date > timezone.now() or not self.choice_set.exists()
+        has_choices = getattr(self, 'has_choices', None)
+        if has_choices is None:
+            has_choices = self.choice_set.exists()
+        return self.pub_date > timezone.now() or not has_choices
 
     def __str__(self):
         return self.question_text
 
 
+class ChoiceQuerySet(models.QuerySet):
+    def with_total_votes(self):
+        """Annotate `total_votes`: compacted votes plus the not yet compacted shard counts."""
+        total_votes = F('votes') + Coalesce(Sum('shards__votes'), 0)
+        return self.annotate(total_votes=total_votes).order_by('-total_votes')
+
+
 class Choice(models.Model):
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
     votes = models.IntegerField(default=0)
 
+    objects = ChoiceQuerySet.as_manager()
+
     class Meta:
-        ordering = ['-votes']
+        # For the choices inline of the question admin. The results page orders by `total_votes`, an
+        # aggregate over the shards as well, which no index covers.
+        indexes = [models.Index(fields=['question', '-votes'], name='choice_question_votes_idx')]
 
     def __str__(self):
         return self.choice_text
 
 
+class ChoiceShard(models.Model):
+    """
+    One of several counter rows for a choice, so that concurrent votes for a
+    popular choice don't all contend for the same row.
+    """
+
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    votes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['choice', 'index'], name='unique_choice_shard')]
+
+    def __str__(self):
+        return f'{self.choice} #{self.index}'
+
+    @classmethod
+    def increment(cls, choice_id, shards):
+        """Add a vote to a random one of the `shards` counters of the choice."""
+        index = random.randrange(shards)
+        if cls.objects.filter(choice_id=choice_id, index=index).update(votes=F('votes') + 1):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(choice_id=choice_id, index=index, votes=1)
+        except IntegrityError:
+            # Another request created the shard first.
+            cls.objects.filter(choice_id=choice_id, index=index).update(votes=F('votes') + 1)
+
+    @classmethod
+    def compact(cls):
+        """Move shard counts into ``Choice.votes`` and return the number of votes moved."""
+        moved = 0
+        for shard in cls.objects.exclude(votes=0).only('pk', 'choice_id', 'votes').iterator():
+            # Subtract what was read rather than resetting to zero, so votes
+            # that land on the shard in the meantime are kept.
+            with transaction.atomic():
+                cls.objects.filter(pk=shard.pk).update(votes=F('votes') - shard.votes)
+                Choice.objects.filter(pk=shard.choice_id).update(votes=F('votes') + shard.votes)
+            moved += shard.votes
+        return moved
+
+
+class Vote(models.Model):
+    """A user's vote on a question; everyone votes at most once per question."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'question'], name='unique_user_question_vote')]
+
+    def __str__(self):
+        return f'{self.user} on {self.question}'
+
+
+class VoteEvent(models.Model):
+    """Append-only log of votes, aggregated into `VoteRollup` by ``polls.rollups``."""
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.choice_id} at {self.created_date}'
+
+
+class VoteRollup(models.Model):
+    """Votes for a choice in the hour or day starting at `start`."""
+
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIODS = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    period = models.CharField(max_length=4, choices=PERIODS)
+    start = models.DateTimeField()
+    votes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['choice', 'period', 'start'], name='unique_vote_rollup')]
+        indexes = [models.Index(fields=['question', 'period', 'start'])]
+
+    def __str__(self):
+        return f'{self.choice_id} {self.period} {self.start}'
+
+
+class Checkpoint(models.Model):
+    """How far a named job got through its input, as the last id or row it processed."""
+
+    name = models.CharField(max_length=50, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.last_id}'
+
+
+class QuestionStats(models.Model):
+    """
+    Running totals of a question, kept up to date by ``polls.signals`` as
+    votes and comments come in. ``reconcile()`` recomputes them from the
+    choice, comment and vote tables.
+    """
+
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total_votes = models.IntegerField(default=0)
+    leader = models.ForeignKey(Choice, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    leader_votes = models.IntegerField(default=0)
+    choice_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    last_activity = models.DateTimeField(default=timezone.now)
+
+    FIELDS = ['total_votes', 'leader_id', 'leader_votes', 'choice_count', 'comment_count', 'last_activity']
+
+    class Meta:
+        verbose_name_plural = 'question stats'
+
+    def __str__(self):
+        return f'Stats of {self.question_id}'
+
+    @classmethod
+    def record_vote(cls, question_id, choice_id, count=1):
+        """
+        Count `count` votes for a choice, already added to its total, in two
+        queries; the choice takes the lead when it passes the leader.
+        """
+        votes = Choice.objects.filter(pk=choice_id).with_total_votes().values_list('total_votes', flat=True).first()
+        if votes is None:
+            return
+        updated = cls.objects.filter(pk=question_id).update(
+            total_votes=F('total_votes') + count,
+            leader=Case(
+                When(leader_votes__lt=votes, then=Value(choice_id)),
+                default=F('leader'),
+                output_field=models.IntegerField(),
+            ),
+            leader_votes=Greatest(F('leader_votes'), Value(votes)),
+            last_activity=timezone.now(),
+        )
+        if not updated:
+            cls.reconcile([question_id])
+
+    @classmethod
+    def record_comment(cls, question_id, added, created_date=None):
+        changes = {'comment_count': F('comment_count') + (1 if added else -1)}
+        if added:
+            changes['last_activity'] = Greatest(F('last_activity'), Value(created_date, models.DateTimeField()))
+        if not cls.objects.filter(pk=question_id).update(**changes):
+            # Not when the comment is deleted along with its question.
+            cls.reconcile([question_id], create=added)
+
+    @classmethod
+    def compute(cls, question_ids):
+        """Return unsaved stats of the existing questions among `question_ids`, from scratch."""
+        stats = {
+            pk: cls(question_id=pk, last_activity=pub_date)
+            for pk, pub_date in Question.objects.filter(pk__in=question_ids).values_list('pk', 'pub_date')
+        }
+        for choice in Choice.objects.filter(question_id__in=stats).with_total_votes().order_by('question_id', 'pk'):
+            row = stats[choice.question_id]
+            row.total_votes += choice.total_votes
+            row.choice_count += 1
+            if row.leader_id is None or choice.total_votes > row.leader_votes:
+                row.leader_id, row.leader_votes = choice.pk, choice.total_votes
+        comments = Comment.objects.filter(question_id__in=stats).values('question_id')
+        for question_id, count, last in comments.annotate(n=Count('pk'), last=Max('created_date')).values_list(
+            'question_id', 'n', 'last'
+        ):
+            stats[question_id].comment_count = count
+            stats[question_id].last_activity = max(stats[question_id].last_activity, last)
+        votes = Vote.objects.filter(question_id__in=stats).values('question_id')
+        for question_id, last in votes.annotate(last=Max('created_date')).values_list('question_id', 'last'):
+            stats[question_id].last_activity = max(stats[question_id].last_activity, last)
+        return stats
+
+    @classmethod
+    def reconcile(cls, question_ids, create=True):
+        """Repair the stats of `question_ids`, creating missing ones if `create`; returns how many were off."""
+        computed = cls.compute(question_ids)
+        existing = cls.objects.in_bulk(list(computed))
+        drifted = [
+            stats
+            for pk, stats in computed.items()
+            if pk in existing and any(getattr(stats, f) != getattr(existing[pk], f) for f in cls.FIELDS[:-1])
+        ]
+        cls.objects.bulk_update(drifted, cls.FIELDS)
+        missing = [stats for pk, stats in computed.items() if pk not in existing] if create else []
+        cls.objects.bulk_create(missing, ignore_conflicts=True)
+        return len(drifted) + len(missing)
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.CharField(max_length=100, default='Please add a profile')
@@ -58,5 +284,8 @@ class Comment(models.Model):
     text = models.TextField()
     created_date = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [models.Index(fields=['question', 'created_date', 'id'])]
+
     def __str__(self):
         return self.text
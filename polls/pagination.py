@@ -0,0 +1,129 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of ``OFFSET n``, which makes the database walk past every skipped
+row, each page continues from the sort key of the last row shown, e.g.
+``WHERE (pub_date, id) < (last_pub_date, last_id)``. With an index on the
+sort key, every page costs the same however deep it is. Cursors are opaque,
+URL-safe strings.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginate `queryset` by `ordering`, a list of field names as accepted by
+    ``order_by()``. The last field must be unique (usually ``id``) so that
+    every row has a distinct position. Nullable fields are not supported.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        """Return the page after (or before) `cursor`; the first page for a missing or invalid cursor."""
+        direction, values = 'next', None
+        if cursor:
+            try:
+                direction, values = self.decode_cursor(cursor)
+            except InvalidCursor:
+                pass
+
+        # Pages before the cursor are fetched in reverse order, then flipped.
+        ordering = self.ordering if direction == 'next' else [(name, not desc) for name, desc in self.ordering]
+        queryset = self.queryset.order_by(*[f'-{name}' if desc else name for name, desc in ordering])
+        if values is not None:
+            queryset = queryset.filter(self.seek(ordering, values))
+        rows = list(queryset[: self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        if direction == 'next':
+            has_next, has_previous = more, values is not None
+        else:
+            rows.reverse()
+            has_next, has_previous = values is not None, more
+
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1], 'next') if has_next and rows else None,
+            previous_cursor=self.encode_cursor(rows[0], 'prev') if has_previous and rows else None,
+        )
+
+    @staticmethod
+    def seek(ordering, values):
+        """Rows strictly after `values` in `ordering`, as a lexicographic comparison."""
+        condition = Q()
+        for i, (name, desc) in enumerate(ordering):
+            step = Q(**{f'{name}__lt' if desc else f'{name}__gt': values[i]})
+            for (prefix, _), value in zip(ordering[:i], values):
+                step &= Q(**{prefix: value})
+            condition |= step
+        return condition
+
+    def encode_cursor(self, obj, direction):
+        values = [getattr(obj, name) for name, _ in self.ordering]
+        payload = json.dumps([direction, values], default=str)
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        fields = [self.queryset.model._meta.get_field(name) for name, _ in self.ordering]
+        try:
+            direction, values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            if direction not in ('next', 'prev') or len(values) != len(fields):
+                raise InvalidCursor(cursor)
+            values = [field.to_python(value) for field, value in zip(fields, values)]
+        except (ValueError, TypeError, ValidationError, binascii.Error):
+            raise InvalidCursor(cursor)
+        if None in values:
+            raise InvalidCursor(cursor)
+        return direction, values
+
+
+class KeysetPaginationMixin:
+    """Keyset pagination for a ``ListView``, ordered by `keyset_ordering`."""
+
+    keyset_ordering = ['id']
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        page = self.get_page(queryset, page_size, self.request.GET.get(self.cursor_kwarg))
+        return None, page, page.object_list, page.has_other_pages()
+
+    def get_page(self, queryset, page_size, cursor):
+        return KeysetPaginator(queryset, self.keyset_ordering, page_size).page(cursor)
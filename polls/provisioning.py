@@ -0,0 +1,77 @@
+"""
+Bulk creation of users.
+
+``User.objects.create_user()`` hashes the password on the calling thread and
+inserts the user and then, from the ``create_and_save_profile`` receiver, its
+profile. ``provision_users()`` hashes passwords across a process pool and
+inserts users and profiles with one ``bulk_create`` each per batch, in a
+transaction so that every user still gets a profile.
+"""
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import Profile
+
+USER_FIELDS = ['email', 'first_name', 'last_name', 'is_staff']
+
+
+def hash_passwords(passwords, workers=None):
+    """Hash `passwords` in `workers` processes (default: one per CPU, 0: in this process)."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 0 or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    with ProcessPoolExecutor(workers, initializer=django.setup) as executor:
+        return list(executor.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def provision_users(rows, batch_size=500, workers=None):
+    """
+    Create users from dicts with a username, password (None for an unusable
+    password), optionally the fields in `USER_FIELDS` and a profile "bio".
+    Raises ValueError, before creating anyone, if a username is taken or
+    appears twice. Returns the number of users created.
+
+    Users are committed batch by batch, so if a later batch fails (e.g. a
+    username got taken in the meantime) the earlier ones remain.
+    """
+    rows = list(rows)
+    usernames = [row['username'] for row in rows]
+    duplicates = {name for name, count in Counter(usernames).items() if count > 1}
+    for start in range(0, len(usernames), batch_size):
+        taken = User.objects.filter(username__in=usernames[start : start + batch_size])
+        duplicates.update(taken.values_list('username', flat=True))
+    if duplicates:
+        raise ValueError(f'Usernames already taken: {", ".join(sorted(duplicates))}')
+
+    passwords = hash_passwords([row['password'] for row in rows], workers)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start : start + batch_size]
+        users = [
+            User(
+                username=row['username'],
+                password=password,
+                **{field: row[field] for field in USER_FIELDS if row.get(field) is not None},
+            )
+            for row, password in zip(batch, passwords[start : start + batch_size])
+        ]
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            # bulk_create() sends no post_save, so create the profiles here. Not
+            # every database returns the new ids, so look them up.
+            created = User.objects.filter(username__in=usernames[start : start + batch_size])
+            ids = dict(created.values_list('username', 'pk'))
+            profiles = []
+            for row in batch:
+                profile = Profile(user_id=ids[row['username']])
+                if row.get('bio'):
+                    profile.bio = row['bio']
+                profiles.append(profile)
+            Profile.objects.bulk_create(profiles)
+    return len(rows)
@@ -0,0 +1,125 @@
+"""
+Rate limiting and load shedding for the views that write.
+
+Every user and every IP address gets a token bucket per scope, kept in the
+cache: `POLLS_RATE_LIMIT_USER` and `POLLS_RATE_LIMIT_IP` are
+"<requests>/<seconds>", the bucket size and the time it takes to refill.
+Buckets are read and written without locking, so concurrent requests may
+occasionally get an extra token. Both limits are off by default.
+
+The IP address is ``REMOTE_ADDR``. Behind a reverse proxy that is the
+proxy's address, so all clients would share one bucket: have the server set
+it to the client's address from the proxy's X-Forwarded-For header, or leave
+`POLLS_RATE_LIMIT_IP` empty.
+
+When writes get slow, e.g. because they queue for SQLite's write lock, the
+average time of the last writes exceeds `POLLS_SHED_WRITE_LATENCY` and all
+processes reject writes for `POLLS_SHED_SECONDS`, so reads keep being served
+quickly.
+"""
+import functools
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+SHED_KEY = 'polls:shed-writes'
+# Weight of the latest write in the average write latency.
+LATENCY_WEIGHT = 0.2
+
+
+def parse_rate(rate):
+    """Return (requests, seconds) of a "<requests>/<seconds>" rate, or None if it's empty."""
+    if not rate:
+        return None
+    requests, seconds = rate.split('/')
+    return int(requests), float(seconds)
+
+
+def take_token(key, rate):
+    """Take a token from the bucket under `key`; return 0, or the seconds until there is one."""
+    capacity, period = rate
+    refill = capacity / period
+    now = time.time()
+    tokens, updated = cache.get(key, (capacity, now))
+    tokens = min(capacity, tokens + (now - updated) * refill)
+    if tokens < 1:
+        return (1 - tokens) / refill
+    cache.set(key, (tokens - 1, now), math.ceil(period))
+    return 0
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def retry_after(request, scope):
+    """Seconds the client has to wait before writing to `scope`, 0 if it may write now."""
+    buckets = [(f'ip:{client_ip(request)}', parse_rate(settings.POLLS_RATE_LIMIT_IP))]
+    if request.user.is_authenticated:
+        buckets.append((f'user:{request.user.pk}', parse_rate(settings.POLLS_RATE_LIMIT_USER)))
+    for name, rate in buckets:
+        if rate:
+            # Stop at the first bucket that rejects, without taking from the others.
+            seconds = take_token(f'polls:ratelimit:{scope}:{name}', rate)
+            if seconds:
+                return seconds
+    return 0
+
+
+class WriteLatency:
+    """Moving average of the time writes take in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.average = 0.0
+
+    def record(self, duration):
+        threshold = settings.POLLS_SHED_WRITE_LATENCY
+        with self._lock:
+            self.average += LATENCY_WEIGHT * (duration - self.average)
+            overloaded = threshold and self.average > threshold
+            if overloaded:
+                # Start afresh once shedding is over.
+                self.average = 0.0
+        if overloaded:
+            cache.set(SHED_KEY, True, settings.POLLS_SHED_SECONDS)
+
+
+write_latency = WriteLatency()
+
+
+def rejected(status, seconds, message):
+    response = HttpResponse(message, status=status, content_type='text/plain')
+    response['Retry-After'] = str(max(1, math.ceil(seconds)))
+    return response
+
+
+def write_limited(scope):
+    """
+    Decorate a view to rate limit and shed its POST requests: they get a 503
+    while writes are shed and a 429 when the client is over its rate.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method != 'POST':
+                return view(request, *args, **kwargs)
+            if settings.POLLS_SHED_WRITE_LATENCY and cache.get(SHED_KEY):
+                return rejected(503, settings.POLLS_SHED_SECONDS, 'The site is busy, please try again later.')
+            seconds = retry_after(request, scope)
+            if seconds:
+                return rejected(429, seconds, 'Too many requests, please try again later.')
+
+            start = time.perf_counter()
+            response = view(request, *args, **kwargs)
+            write_latency.record(time.perf_counter() - start)
+            return response
+
+        return wrapped
+
+    return decorator
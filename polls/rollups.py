@@ -0,0 +1,111 @@
+"""
+Incremental hourly and daily rollups of the ``VoteEvent`` log.
+
+Each run aggregates the events after the ``votes`` watermark into
+``VoteRollup`` buckets and moves the watermark past them in the same
+transaction, so every event is counted exactly once however often it runs.
+Events younger than `POLLS_ROLLUP_DELAY` seconds, and all events after the
+first of them, are left for the next run, as a transaction that is still open
+may be about to commit an event with a lower id. Days are in the site's time zone.
+"""
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .cache import bump_question_version
+from .models import Checkpoint, VoteEvent, VoteRollup
+
+WATERMARK = 'votes'
+
+
+def bucket_start(moment, period):
+    moment = timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+    if period == VoteRollup.DAY:
+        # Midnight, which may be a different UTC offset from the vote in DST zones.
+        moment = timezone.make_aware(datetime.datetime.combine(moment.date(), datetime.time()))
+    return moment
+
+
+def rollup_batch(batch_size):
+    """Roll up the next `batch_size` events; returns how many there were."""
+    cutoff = timezone.now() - datetime.timedelta(seconds=settings.POLLS_ROLLUP_DELAY)
+    with transaction.atomic():
+        watermark, _ = Checkpoint.objects.select_for_update().get_or_create(name=WATERMARK)
+        events = []
+        # Stop at the first event that is too recent: one after it may be older
+        # but must not move the watermark past it.
+        for event in (
+            VoteEvent.objects.filter(pk__gt=watermark.last_id)
+            .order_by('pk')
+            .values_list('pk', 'question_id', 'choice_id', 'created_date')[:batch_size]
+        ):
+            if event[3] >= cutoff:
+                break
+            events.append(event)
+        if not events:
+            return 0
+
+        counts = Counter()
+        for _, question_id, choice_id, created_date in events:
+            for period, _ in VoteRollup.PERIODS:
+                counts[question_id, choice_id, period, bucket_start(created_date, period)] += 1
+        for (question_id, choice_id, period, start), votes in counts.items():
+            bucket = VoteRollup.objects.filter(choice_id=choice_id, period=period, start=start)
+            if not bucket.update(votes=F('votes') + votes):
+                VoteRollup.objects.create(
+                    question_id=question_id, choice_id=choice_id, period=period, start=start, votes=votes
+                )
+
+        watermark.last_id = events[-1][0]
+        watermark.save()
+    # The results page caches the daily votes.
+    bump_question_version(*{question_id for _, question_id, _, _ in events})
+    return len(events)
+
+
+def rollup_votes(batch_size=10000):
+    """Roll up all events that are due; returns how many there were."""
+    total = 0
+    while True:
+        done = rollup_batch(batch_size)
+        total += done
+        if done < batch_size:
+            return total
+
+
+def prune_vote_events(batch_size=10000):
+    """
+    Delete events that have been rolled up and are older than
+    `POLLS_VOTE_EVENT_RETENTION_DAYS`; returns how many.
+    """
+    watermark = Checkpoint.objects.filter(name=WATERMARK).values_list('last_id', flat=True).first() or 0
+    cutoff = timezone.now() - datetime.timedelta(days=settings.POLLS_VOTE_EVENT_RETENTION_DAYS)
+    expired = VoteEvent.objects.filter(pk__lte=watermark, created_date__lt=cutoff)
+    deleted = 0
+    while True:
+        ids = list(expired.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += VoteEvent.objects.filter(pk__in=ids).delete()[0]
+
+
+def trends(question_id, period=VoteRollup.DAY, since=None):
+    """Votes per choice per bucket from the rollups, as {choice_id: [(start, votes), ...]}."""
+    rollups = VoteRollup.objects.filter(question_id=question_id, period=period)
+    if since:
+        rollups = rollups.filter(start__gte=since)
+    series = {}
+    for choice_id, start, votes in rollups.order_by('start').values_list('choice_id', 'start', 'votes'):
+        series.setdefault(choice_id, []).append((start, votes))
+    return series
+
+
+def daily_votes(question_id, days):
+    """Total votes per day over the last `days` days, from the rollups."""
+    since = timezone.now() - datetime.timedelta(days=days)
+    rollups = VoteRollup.objects.filter(question_id=question_id, period=VoteRollup.DAY, start__gte=since)
+    return list(rollups.values('start').annotate(votes=Sum('votes')).order_by('start'))
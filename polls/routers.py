@@ -0,0 +1,60 @@
+"""
+Send reads to the read replicas listed in `POLLS_DB_REPLICAS` and writes to
+the primary (``default``) database.
+
+Replicas lag behind the primary, so a request stops using them as soon as it
+writes, and ``PrimaryPinningMiddleware`` keeps the client on the primary for
+`POLLS_DB_PIN_SECONDS` after that: a voter redirected to the results always
+sees their vote. Outside of requests, e.g. in management commands,
+everything goes to the primary.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+_state = ContextVar('polls_db_state', default=None)
+
+
+class RequestState:
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        # Chosen on the first read, so that all of the request's reads see the same replica's data.
+        self.replica = None
+
+
+def start_request(pinned=False):
+    """Route the queries of the current request; returns the state and a token for `end_request`."""
+    state = RequestState(pinned)
+    return state, _state.set(state)
+
+
+def end_request(token):
+    _state.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.pinned or not settings.POLLS_DB_REPLICAS:
+            return 'default'
+        if state.replica is None:
+            state.replica = random.choice(settings.POLLS_DB_REPLICAS)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication.
+        if db in settings.POLLS_DB_REPLICAS:
+            return False
+        return None
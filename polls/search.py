@@ -0,0 +1,155 @@
+"""
+Full-text search over question texts and comments.
+
+On SQLite the texts are indexed in the FTS5 table ``polls_search``, which is
+created together with the triggers that keep it in sync after migrations
+(see ``PollsConfig.ready()``), and results are ranked with bm25. Questions
+and comments share the table, told apart by their rowid: ``2 * id`` for
+questions and ``2 * id + 1`` for comments. Other databases, or SQLite built
+without FTS5, fall back to ``icontains`` lookups ordered by date.
+
+Rebuild the index from the tables with ``manage.py rebuild_search_index``.
+"""
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Question
+
+TABLE = 'polls_search'
+
+CREATE_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(body, question_id UNINDEXED, tokenize='porter unicode61')",
+    f'''CREATE TRIGGER IF NOT EXISTS {TABLE}_question_insert AFTER INSERT ON polls_question BEGIN
+        INSERT INTO {TABLE} (rowid, body, question_id) VALUES (2 * new.id, new.question_text, new.id);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {TABLE}_question_update AFTER UPDATE OF question_text ON polls_question BEGIN
+        DELETE FROM {TABLE} WHERE rowid = 2 * old.id;
+        INSERT INTO {TABLE} (rowid, body, question_id) VALUES (2 * new.id, new.question_text, new.id);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {TABLE}_question_delete AFTER DELETE ON polls_question BEGIN
+        DELETE FROM {TABLE} WHERE rowid = 2 * old.id;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {TABLE}_comment_insert AFTER INSERT ON polls_comment BEGIN
+        INSERT INTO {TABLE} (rowid, body, question_id) VALUES (2 * new.id + 1, new.text, new.question_id);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {TABLE}_comment_update AFTER UPDATE OF text, question_id ON polls_comment BEGIN
+        DELETE FROM {TABLE} WHERE rowid = 2 * old.id + 1;
+        INSERT INTO {TABLE} (rowid, body, question_id) VALUES (2 * new.id + 1, new.text, new.question_id);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS {TABLE}_comment_delete AFTER DELETE ON polls_comment BEGIN
+        DELETE FROM {TABLE} WHERE rowid = 2 * old.id + 1;
+    END''',
+]
+
+REBUILD_SQL = [
+    f'DELETE FROM {TABLE}',
+    f'INSERT INTO {TABLE} (rowid, body, question_id) SELECT 2 * id, question_text, id FROM polls_question',
+    f'INSERT INTO {TABLE} (rowid, body, question_id) SELECT 2 * id + 1, text, question_id FROM polls_comment',
+    f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')",
+]
+
+# The rank column is the bm25() score, lower is better; bm25() itself can't be aggregated.
+SEARCH_SQL = f'''
+    SELECT question_id, MIN(rank) AS best FROM {TABLE}
+    WHERE {TABLE} MATCH %s GROUP BY question_id ORDER BY best, question_id LIMIT %s OFFSET %s
+'''
+
+# Aliases of the databases known to have the index.
+_available = set()
+
+
+def create_search_index(sender=None, using='default', **kwargs):
+    """``post_migrate`` receiver creating the index and its triggers, where SQLite has FTS5."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or not router.allow_migrate_model(using, Question):
+        return
+    try:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            created = not table_exists(cursor)
+            for sql in CREATE_SQL:
+                cursor.execute(sql)
+            if created:
+                # Index what is already there, e.g. when upgrading an existing database.
+                for sql in REBUILD_SQL:
+                    cursor.execute(sql)
+    except DatabaseError:
+        # No FTS5 in this SQLite build, searches use the fallback.
+        return
+    _available.add(using)
+
+
+def table_exists(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [TABLE])
+    return cursor.fetchone() is not None
+
+
+def search_available(using):
+    connection = connections[using]
+    if using not in _available and connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            if table_exists(cursor):
+                _available.add(using)
+    return using in _available
+
+
+def rebuild_search_index(using='default'):
+    """Index all questions and comments from scratch."""
+    create_search_index(using=using)
+    if not search_available(using):
+        return False
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        for sql in REBUILD_SQL:
+            cursor.execute(sql)
+    return True
+
+
+def match_expression(text):
+    """
+    Turn user input into an FTS5 query matching all of its words, the last
+    one as a prefix. Returns '' if there are no words.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return ''
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+def search_questions(text, limit=None):
+    """Return the visible questions matching `text` in their text or comments, best matches first."""
+    limit = limit or settings.POLLS_SEARCH_MAX_RESULTS
+    expression = match_expression(text)
+    if not expression:
+        return []
+    using = router.db_for_read(Question)
+    questions = Question.objects.using(using).visible()
+    if not search_available(using):
+        matches = Q(question_text__icontains=text) | Q(comment__text__icontains=text)
+        return list(questions.filter(matches).distinct().order_by('-pub_date', '-id')[:limit])
+
+    # Hidden questions are only filtered out after ranking, so fetch further
+    # batches of matches until there are enough visible ones.
+    results = []
+    offset = 0
+    while len(results) < limit:
+        with connections[using].cursor() as cursor:
+            cursor.execute(SEARCH_SQL, [expression, limit, offset])
+            ranks = dict(cursor.fetchall())
+        results += sorted(questions.filter(pk__in=ranks), key=lambda question: ranks[question.pk])
+        if len(ranks) < limit:
+            break
+        offset += limit
+    return results[:limit]
+
+
+def filter_matching(queryset, text):
+    """Filter a question queryset to those matching `text`, without ranking or limits (for the admin)."""
+    expression = match_expression(text)
+    if not expression:
+        return queryset
+    if not search_available(queryset.db):
+        return queryset.filter(Q(question_text__icontains=text) | Q(comment__text__icontains=text)).distinct()
+    return queryset.filter(pk__in=RawSQL(f'SELECT question_id FROM {TABLE} WHERE {TABLE} MATCH %s', [expression]))
@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .cache import bump_question_version, invalidate_index, user_key, voted_key
+from .live import get_broker
+from .models import Choice, Comment, Profile, Question, QuestionStats, Vote
+
+# Sent by the vote view with `question_id` and `choice_id` arguments.
+vote_cast = Signal()
+
+
+@receiver(vote_cast)
+def vote_cast_bump_version(sender, question_id, **kwargs):
+    bump_question_version(question_id)
+
+
+@receiver(vote_cast)
+def vote_cast_update_stats(sender, question_id, choice_id, **kwargs):
+    # Buffered votes are counted when the buffer is flushed (polls.buffer.apply_vote_counts), once
+    # they are in the choice's total.
+    if not settings.POLLS_VOTE_BUFFER:
+        QuestionStats.record_vote(question_id, choice_id)
+
+
+@receiver(vote_cast)
+def vote_cast_publish(sender, question_id, choice_id, **kwargs):
+    get_broker().publish(question_id, choice_id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed_bump_version(sender, instance, **kwargs):
+    bump_question_version(instance.pk)
+    invalidate_index()
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed_bump_version(sender, instance, **kwargs):
+    bump_question_version(instance.question_id)
+    # The first or last choice of a question changes its visibility.
+    invalidate_index()
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed_bump_version(sender, instance, **kwargs):
+    bump_question_version(instance.question_id)
+
+
+@receiver(post_save, sender=Question)
+def question_created_add_stats(sender, instance, created, **kwargs):
+    if created:
+        QuestionStats.objects.create(question=instance, last_activity=instance.pub_date)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed_update_stats(sender, instance, **kwargs):
+    # Rare, so just recount; don't recreate stats while the question is being deleted.
+    QuestionStats.reconcile([instance.question_id], create='created' in kwargs)
+
+
+@receiver(post_save, sender=Comment)
+def comment_added_update_stats(sender, instance, created, **kwargs):
+    if created:
+        QuestionStats.record_comment(instance.question_id, True, instance.created_date)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted_update_stats(sender, instance, **kwargs):
+    QuestionStats.record_comment(instance.question_id, False)
+
+
+@receiver(post_delete, sender=Vote)
+def vote_deleted_invalidate_voted(sender, instance, **kwargs):
+    cache.delete(voted_key(instance.user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def user_changed_invalidate_record(sender, instance, **kwargs):
+    # Covers password changes, which must end other sessions right away.
+    cache.delete(user_key(instance.user_id if sender is Profile else instance.pk))
+
+
+@receiver(user_logged_out)
+def user_logged_out_invalidate_record(sender, request, user, **kwargs):
+    if user is not None:
+        cache.delete(user_key(user.pk))
@@ -0,0 +1,11 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def url_replace(context, key, value):
+    """Return the current query string with `key` set to `value`."""
+    query = context['request'].GET.copy()
+    query[key] = value
+    return query.urlencode()
@@ -1,11 +1,55 @@
+import base64
 import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
 
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
-from .models import Choice, Question, Comment, Profile
+from .buffer import VoteBuffer, apply_vote_counts, read_journal, recover_journals
+from .cache import question_version, question_versions, user_key, version_timeout, voted_key
+from .live import Broker, LiveResultsApp, LocalBroker
+from .management.commands import benchmark_routes
+from .middleware import PIN_COOKIE, route_stats
+from .models import (
+    Checkpoint,
+    Choice,
+    ChoiceShard,
+    Comment,
+    Profile,
+    Question,
+    QuestionStats,
+    Vote,
+    VoteEvent,
+    VoteRollup,
+)
+from .pagination import KeysetPaginationMixin, KeysetPaginator
+from .provisioning import hash_passwords, provision_users
+from .ratelimit import SHED_KEY, write_latency
+from .rollups import prune_vote_events, rollup_votes
+from .search import match_expression, search_available, search_questions
+from .routers import ReplicaRouter, end_request, start_request
+from .urls import urlpatterns
 
 
 class QuestionModelTests(TestCase):
@@ -44,6 +88,15 @@ class QuestionModelTests(TestCase):
         question = create_question(question_text='Future question', days=-30, nchoices=0)
         assert question.is_hidden()
 
+    def test_visible(self):
+        visible = create_question(question_text='Past question', days=-30)
+        create_question(question_text='Future question', days=30)
+        create_question(question_text='No choices', days=-30, nchoices=0)
+        with self.assertNumQueries(1):
+            questions = list(Question.objects.visible())
+            assert questions == [visible]
+            assert not questions[0].is_hidden()
+
 
 class ProfileModelTests(TestCase):
     def test_auto_profile_creation(self):
@@ -61,7 +114,34 @@ class ChoiceModelTests(TestCase):
         first.save()
         second.votes = 2
         second.save()
-        assert question.choice_set.first() == question.choice_set.order_by('-votes').first()
+        # Choices are only sorted where needed, by the (question, -votes) index.
+        assert not question.choice_set.all().ordered
+        assert list(question.choice_set.with_total_votes()) == [second, first]
+
+
+class ChoiceShardTests(TestCase):
+    def test_total_votes_sum_shards(self):
+        question = create_question(question_text='Past Question', days=-5, nchoices=2)
+        first, second = question.choice_set.all()
+        Choice.objects.filter(pk=first.pk).update(votes=3)
+        for _ in range(5):
+            ChoiceShard.increment(second.pk, shards=4)
+        assert 1 <= second.shards.count() <= 4
+
+        choices = list(question.choice_set.with_total_votes())
+        assert [(choice.pk, choice.total_votes) for choice in choices] == [(second.pk, 5), (first.pk, 3)]
+
+    def test_compact(self):
+        question = create_question(question_text='Past Question', days=-5, nchoices=1)
+        choice = question.choice_set.first()
+        for _ in range(7):
+            ChoiceShard.increment(choice.pk, shards=3)
+
+        assert ChoiceShard.compact() == 7
+        choice.refresh_from_db()
+        assert choice.votes == 7
+        assert not ChoiceShard.objects.exclude(votes=0).exists()
+        assert Choice.objects.with_total_votes().get(pk=choice.pk).total_votes == 7
 
 
 def create_question(question_text, days, nchoices=2) -> Question:
@@ -78,6 +158,41 @@ def create_question(question_text, days, nchoices=2) -> Question:
     return question
 
 
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        # Pairs of questions share a pub_date, so pages must break ties by id.
+        time = timezone.now()
+        for i in range(7):
+            Question.objects.create(question_text=f'Question {i}', pub_date=time - datetime.timedelta(days=i // 2))
+        self.paginator = KeysetPaginator(Question.objects.all(), ['-pub_date', '-id'], per_page=3)
+        self.expected = list(Question.objects.order_by('-pub_date', '-id'))
+
+    def test_forward_and_back(self):
+        first = self.paginator.page()
+        assert list(first) == self.expected[:3]
+        assert first.has_next() and not first.has_previous()
+
+        second = self.paginator.page(first.next_cursor)
+        assert list(second) == self.expected[3:6]
+        third = self.paginator.page(second.next_cursor)
+        assert list(third) == self.expected[6:]
+        assert not third.has_next() and third.has_previous()
+
+        back = self.paginator.page(third.previous_cursor)
+        assert list(back) == self.expected[3:6]
+        assert list(self.paginator.page(back.previous_cursor)) == self.expected[:3]
+
+    def test_invalid_cursor(self):
+        assert list(self.paginator.page('garbage')) == self.expected[:3]
+        nulls = base64.urlsafe_b64encode(b'["next", [null, null]]').decode()
+        assert list(self.paginator.page(nulls)) == self.expected[:3]
+
+    def test_constant_query_count(self):
+        page = self.paginator.page()
+        with self.assertNumQueries(1):
+            self.paginator.page(page.next_cursor)
+
+
 class IndexViewTests(TestCase):
     def test_no_questions(self):
         """
@@ -128,6 +243,66 @@ class IndexViewTests(TestCase):
             response.context['latest_question_list'], ['<Question: Past question 2>', '<Question: Past question 1>']
         )
 
+    def test_question_without_choices(self):
+        """
+        Questions without choices can't be opened and aren't listed.
+        """
+        create_question(question_text="No choices", days=-30, nchoices=0)
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "No polls are available.")
+
+    def test_first_choice_invalidates_index(self):
+        question = create_question(question_text="No choices", days=-30, nchoices=0)
+        self.client.get(reverse('polls:index'))
+        Choice.objects.create(question=question, choice_text='Choice 1')
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "No choices")
+
+    def test_pages(self):
+        for i in range(7):
+            create_question(question_text=f"Past question {i}", days=-i - 1)
+        response = self.client.get(reverse('polls:index'))
+        assert len(response.context['latest_question_list']) == 5
+        cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(reverse('polls:index'), {'cursor': cursor})
+        self.assertQuerysetEqual(
+            response.context['latest_question_list'], ['<Question: Past question 5>', '<Question: Past question 6>']
+        )
+
+    def test_index_cached(self):
+        create_question(question_text="Past question", days=-30)
+        self.client.get(reverse('polls:index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Past question")
+
+    def test_new_question_invalidates_index(self):
+        self.client.get(reverse('polls:index'))
+        create_question(question_text="Past question", days=-30)
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Past question")
+
+    def test_index_invalidated_while_read(self):
+        create_question(question_text="Past question", days=-30)
+        get_page = KeysetPaginationMixin.get_page
+
+        def get_page_then_invalidate(*args):
+            page = get_page(*args)
+            create_question(question_text="New question", days=-1)
+            return page
+
+        with mock.patch.object(KeysetPaginationMixin, 'get_page', get_page_then_invalidate):
+            self.client.get(reverse('polls:index'))
+        self.assertContains(self.client.get(reverse('polls:index')), "New question")
+
+    def test_index_expires_at_next_pub_date(self):
+        time = timezone.now() + datetime.timedelta(seconds=60)
+        Question.objects.create(question_text="Scheduled question", pub_date=time)
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.client.get(reverse('polls:index'))
+        timeout = cache_set.call_args[0][2]
+        assert 59 < timeout <= 60
+
 
 class QuestionViewTests(TestCase):
     def test_future_question(self):
@@ -156,6 +331,13 @@ class QuestionViewTests(TestCase):
         response = self.client.get(url)
         assert response.status_code == 404
 
+    def test_choices_in_creation_order(self):
+        question = create_question(question_text='Past question', days=-5, nchoices=3)
+        question.choice_set.filter(choice_text='Choice 3').update(votes=5)
+        response = self.client.get(reverse('polls:question', args=[question.pk]))
+        content = response.content.decode()
+        assert content.index('Choice 1') < content.index('Choice 2') < content.index('Choice 3')
+
     def test_future_question_admin(self):
         password = 'password'
         admin = User.objects.create_superuser(username='admin', password=password)
@@ -206,6 +388,166 @@ class ResultsViewTests(TestCase):
         self.assertContains(response, future_question.choice_set.first().choice_text)
 
 
+class QuestionCacheTests(TestCase):
+    def test_results_page_cached(self):
+        question = create_question(question_text='Past question', days=-5)
+        url = reverse('polls:results', args=[question.pk])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, question.question_text)
+
+    def test_no_versions_for_missing_questions(self):
+        for name in ('question', 'results', 'comments', 'trends'):
+            assert self.client.get(reverse(f'polls:{name}', args=[998])).status_code == 404
+        assert self.client.get(reverse('polls:results_api'), {'ids': '998,999'}).json() == {'questions': []}
+        assert question_versions([998, 999]) == {}
+
+    def test_versions_expire(self):
+        question = create_question(question_text='Past question', days=-5)
+        cache.clear()
+        self.client.get(reverse('polls:results', args=[question.pk]))
+        version = question_version(question.pk)
+        assert version is not None
+        later = time.time() + version_timeout() + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            assert question_version(question.pk) is None
+            response = self.client.get(reverse('polls:results', args=[question.pk]))
+            self.assertContains(response, question.question_text)
+            assert question_version(question.pk) > version
+
+    def test_vote_invalidates_results(self):
+        password = 'password'
+        user = User.objects.create_user(username='user', password=password)
+        self.client.login(username=user.username, password=password)
+        question = create_question(question_text='Past question', days=-5)
+        choice = question.choice_set.first()
+        url = reverse('polls:results', args=[question.pk])
+        self.client.get(url)
+
+        response = self.client.post(reverse('polls:vote', args=[question.pk]), data={'choice': choice.pk}, follow=True)
+        self.assertContains(response, f'<td id="votes-{choice.pk}">1</td>')
+
+    def test_comment_invalidates_question(self):
+        question = create_question(question_text='Past question', days=-5)
+        url = reverse('polls:question', args=[question.pk])
+        self.assertContains(self.client.get(url), 'No comments here yet')
+        Comment.objects.create(question=question, author='anon', text='First!')
+        self.assertContains(self.client.get(url), 'First!')
+
+    def test_comment_pages(self):
+        """
+        The question page shows the newest comments; older ones are loaded
+        from the comments endpoint.
+        """
+        question = create_question(question_text='Past question', days=-5)
+        for i in range(5):
+            Comment.objects.create(question=question, author='anon', text=f'Comment {i}')
+        url = reverse('polls:question', args=[question.pk])
+        with self.settings(POLLS_COMMENTS_PER_PAGE=2):
+            response = self.client.get(url)
+            self.assertContains(response, 'Comment 4')
+            self.assertContains(response, 'Comment 3')
+            self.assertNotContains(response, 'Comment 2')
+
+            cursor = response.context['comments'].next_cursor
+            data = self.client.get(reverse('polls:comments', args=[question.pk]), {'cursor': cursor}).json()
+            assert 'Comment 2' in data['html'] and 'Comment 1' in data['html']
+            assert 'Comment 3' not in data['html']
+            data = self.client.get(data['next_url']).json()
+            assert 'Comment 0' in data['html']
+            assert data['next_url'] is None
+
+    def test_comments_of_hidden_question(self):
+        question = create_question(question_text='Future question', days=5)
+        response = self.client.get(reverse('polls:comments', args=[question.pk]))
+        assert response.status_code == 404
+
+    def test_choice_edit_invalidates_question(self):
+        question = create_question(question_text='Past question', days=-5)
+        url = reverse('polls:question', args=[question.pk])
+        self.client.get(url)
+        choice = question.choice_set.first()
+        choice.choice_text = 'Edited choice'
+        choice.save()
+        self.assertContains(self.client.get(url), 'Edited choice')
+
+    def test_hidden_question_admin_bypasses_cache(self):
+        password = 'password'
+        admin = User.objects.create_superuser(username='admin', password=password)
+        self.client.login(username=admin.username, password=password)
+        question = create_question(question_text='Future question', days=5)
+        url = reverse('polls:results', args=[question.pk])
+        self.client.get(url)
+        # update() sends no signals, so only an uncached page can show it
+        question.choice_set.update(choice_text='Edited choice')
+        self.assertContains(self.client.get(url), 'Edited choice')
+
+
+class ResultsApiTests(TestCase):
+    def test_results(self):
+        first = create_question(question_text='First question', days=-5)
+        second = create_question(question_text='Second question', days=-5, nchoices=1)
+        future = create_question(question_text='Future question', days=5)
+        Choice.objects.filter(pk=second.choice_set.get().pk).update(votes=4)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('polls:results_api'), {'ids': f'{second.pk},{first.pk},{future.pk}'})
+        questions = response.json()['questions']
+        assert [question['id'] for question in questions] == [first.pk, second.pk]
+        assert len(questions[0]['choices']) == 2
+        assert questions[1]['choices'] == [{'id': second.choice_set.get().pk, 'choice_text': 'Choice 1', 'votes': 4}]
+
+    def test_not_modified(self):
+        question = create_question(question_text='Past question', days=-5)
+        url = reverse('polls:results_api')
+        response = self.client.get(url, {'ids': question.pk})
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'ids': question.pk}, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        # Also once the response dropped out of the cache.
+        version_hash = etag.strip('"').split('-')[0]
+        assert cache.delete(f'polls:results-api:{version_hash}')
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'ids': question.pk}, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        password = 'password'
+        user = User.objects.create_user(username='user', password=password)
+        self.client.login(username=user.username, password=password)
+        self.client.post(reverse('polls:vote', args=[question.pk]), data={'choice': question.choice_set.first().pk})
+        response = self.client.get(url, {'ids': question.pk}, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
+    def test_scheduled_question_published(self):
+        question = create_question(question_text='Scheduled question', days=1)
+        url = reverse('polls:results_api')
+        assert self.client.get(url, {'ids': question.pk}).json() == {'questions': []}
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + datetime.timedelta(days=2)):
+            questions = self.client.get(url, {'ids': question.pk}).json()['questions']
+        assert [question['id'] for question in questions] == [question.pk]
+
+    def test_not_modified_until_scheduled_question_published(self):
+        question = create_question(question_text='Scheduled question', days=1)
+        url = reverse('polls:results_api')
+        etag = self.client.get(url, {'ids': question.pk})['ETag']
+        assert self.client.get(url, {'ids': question.pk}, HTTP_IF_NONE_MATCH=etag).status_code == 304
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + datetime.timedelta(days=2)):
+            response = self.client.get(url, {'ids': question.pk}, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
+    def test_bad_ids(self):
+        url = reverse('polls:results_api')
+        assert self.client.get(url).status_code == 400
+        assert self.client.get(url, {'ids': '1,x'}).status_code == 400
+        assert self.client.get(url, {'ids': '99999999999999999999999'}).status_code == 400
+        assert self.client.get(url, {'ids': '0,-1'}).status_code == 400
+        assert self.client.get(url, {'ids': ','.join(map(str, range(1, 102)))}).status_code == 400
+
+
 class VoteViewTests(TestCase):
     def test_question_vote(self):
         password = "/'].;[,lp"
@@ -222,6 +564,98 @@ class VoteViewTests(TestCase):
         first_choice.refresh_from_db()
         assert first_choice.votes == 1
 
+    def test_buffered_vote(self):
+        password = "/'].;[,lp"
+        user = User.objects.create_user(username='user', password=password)
+        self.client.login(username=user.username, password=password)
+
+        past_question = create_question(question_text='Past question', days=-5)
+        first_choice = past_question.choice_set.first()
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir)
+        buffer = VoteBuffer(journal_dir, max_votes=10, max_age=0)
+
+        url = reverse('polls:vote', args=[past_question.pk])
+        with self.settings(POLLS_VOTE_BUFFER=True), mock.patch('polls.buffer._buffer', buffer):
+            self.client.post(url, data={'choice': first_choice.pk})
+        first_choice.refresh_from_db()
+        assert first_choice.votes == 0
+        assert QuestionStats.objects.get(pk=past_question.pk).total_votes == 0
+        assert buffer.flush() == 1
+        first_choice.refresh_from_db()
+        assert first_choice.votes == 1
+        stats = QuestionStats.objects.get(pk=past_question.pk)
+        assert (stats.total_votes, stats.leader_id, stats.leader_votes) == (1, first_choice.pk, 1)
+
+    def test_buffered_vote_journal_error(self):
+        password = "/'].;[,lp"
+        user = User.objects.create_user(username='user', password=password)
+        self.client.login(username=user.username, password=password)
+
+        past_question = create_question(question_text='Past question', days=-5)
+        first_choice = past_question.choice_set.first()
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir)
+        buffer = VoteBuffer(journal_dir, max_votes=10, max_age=0)
+
+        url = reverse('polls:vote', args=[past_question.pk])
+        with self.settings(POLLS_VOTE_BUFFER=True), mock.patch('polls.buffer._buffer', buffer):
+            with mock.patch('polls.buffer.os.fsync', side_effect=OSError), self.assertRaises(OSError):
+                self.client.post(url, data={'choice': first_choice.pk})
+            assert not Vote.objects.exists()
+            response = self.client.post(url, data={'choice': first_choice.pk})
+        self.assertRedirects(response, reverse('polls:results', args=[past_question.pk]))
+        assert read_journal(buffer.journal_path) == {first_choice.pk: 1}
+        assert buffer.flush() == 1
+
+    def test_sharded_vote(self):
+        password = "/'].;[,lp"
+        user = User.objects.create_user(username='user', password=password)
+        self.client.login(username=user.username, password=password)
+
+        past_question = create_question(question_text='Past question', days=-5)
+        first_choice = past_question.choice_set.first()
+        url = reverse('polls:vote', args=[past_question.pk])
+        with self.settings(POLLS_VOTE_SHARDS=4):
+            response = self.client.post(url, data={'choice': first_choice.pk}, follow=True)
+        first_choice.refresh_from_db()
+        assert first_choice.votes == 0
+        assert response.context['choices'][0].total_votes == 1
+
+    def test_vote_once(self):
+        password = "/'].;[,lp"
+        user = User.objects.create_user(username='user', password=password)
+        self.client.login(username=user.username, password=password)
+
+        past_question = create_question(question_text='Past question', days=-5)
+        first_choice, second_choice = past_question.choice_set.all()
+        url = reverse('polls:vote', args=[past_question.pk])
+        self.client.post(url, data={'choice': first_choice.pk})
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(url, data={'choice': second_choice.pk})
+        # Rejected by the cached set of voted questions, without a ledger lookup.
+        assert not [query for query in captured if 'polls_vote' in query['sql']]
+        assert response.status_code == 409
+        assert response.context['error_message'] == 'You have already voted on this question.'
+        assert Vote.objects.get(user=user, question=past_question).choice == first_choice
+        assert sum(past_question.choice_set.values_list('votes', flat=True)) == 1
+
+    def test_vote_stale_voted_cache(self):
+        password = "/'].;[,lp"
+        user = User.objects.create_user(username='user', password=password)
+        self.client.login(username=user.username, password=password)
+
+        past_question = create_question(question_text='Past question', days=-5)
+        first_choice = past_question.choice_set.first()
+        cache.set(voted_key(user.pk), set())
+        Vote.objects.create(user=user, question=past_question, choice=first_choice)
+        cache.set(voted_key(user.pk), set())
+        response = self.client.post(reverse('polls:vote', args=[past_question.pk]), data={'choice': first_choice.pk})
+        assert response.status_code == 409
+        first_choice.refresh_from_db()
+        assert first_choice.votes == 0
+        assert cache.get(voted_key(user.pk)) is None
+
     def test_vote_login_redirect(self):
         past_question = create_question(question_text='Past question', days=-5)
         first_choice = past_question.choice_set.first()
@@ -253,7 +687,7 @@ class CreateCommentViewTests(TestCase):
         url = reverse('polls:add_comment', args=[question.pk])
         username = 'anon'
         response = self.client.post(
-            url, data={'question': question.pk, 'author': username, 'text': 'text'}, follow=True,
+            url, data={'author': username, 'text': 'text'}, follow=True,
         )
         self.assertRedirects(response, reverse('polls:question', args=[question.pk]))
         assert len(Comment.objects.all()) == 1
@@ -269,7 +703,7 @@ class CreateCommentViewTests(TestCase):
         question = create_question(question_text='Past question', days=-5)
         url = reverse('polls:add_comment', args=[question.pk])
         response = self.client.post(
-            url, data={'question': question.pk, 'author': user.username, 'text': 'text'}, follow=True,
+            url, data={'author': user.username, 'text': 'text'}, follow=True,
         )
         self.assertRedirects(response, reverse('polls:question', args=[question.pk]))
         assert len(Comment.objects.all()) == 1
@@ -277,6 +711,47 @@ class CreateCommentViewTests(TestCase):
         comment = question.comment_set.first()
         assert comment.author == user.username
 
+    def test_form_renders_in_constant_queries(self):
+        question = create_question(question_text='Past question', days=-5)
+        url = reverse('polls:add_comment', args=[question.pk])
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(url)
+        for i in range(10):
+            create_question(question_text=f'Question {i}', days=-5)
+        with CaptureQueriesContext(connection) as more:
+            response = self.client.get(url)
+        assert len(few) == len(more) == 1
+        assert '<option' not in response.content.decode()
+        form = response.context['form']
+        assert form.fields['created_date'].disabled
+        assert form.fields['text'].widget.attrs['autofocus']
+        response = self.client.get(reverse('polls:question', args=[question.pk]))
+        assert 'autofocus' not in response.content.decode()
+
+    def test_question_from_url(self):
+        question = create_question(question_text='Past question', days=-5)
+        other = create_question(question_text='Other question', days=-5)
+        url = reverse('polls:add_comment', args=[question.pk])
+        self.client.post(url, data={'question': other.pk, 'author': 'anon', 'text': 'text'})
+        assert Comment.objects.get().question == question
+        response = self.client.post(reverse('polls:add_comment', args=[0]), {'author': 'a', 'text': 't'})
+        assert response.status_code == 404
+
+    def test_add_comment_ajax(self):
+        question = create_question(question_text='Past question', days=-5)
+        url = reverse('polls:add_comment', args=[question.pk])
+        response = self.client.post(
+            url, data={'author': 'anon', 'text': 'Hello there'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        assert response.status_code == 201
+        assert '<p>Hello there</p>' in response.content.decode()
+        assert '<html' not in response.content.decode()
+        assert question.comment_set.count() == 1
+
+        response = self.client.post(url, data={'author': 'anon'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        assert response.status_code == 400
+        assert 'text' in response.json()['errors']
+
 
 class UserViewTests(TestCase):
     def test_user_not_logged_in(self):
@@ -309,3 +784,1056 @@ class UserListViewTests(TestCase):
         user_list = response.context_data['user_list']
         assert len(user_list) == 1
         assert user_list[0].username == admin.username
+
+    def test_partitions_and_paginates(self):
+        password = 'password'
+        admin = User.objects.create_superuser(username='admin', password=password)
+        User.objects.bulk_create([User(username=f'user{i}') for i in range(60)])
+        self.client.login(username=admin.username, password=password)
+        url = reverse('polls:user_list')
+
+        response = self.client.get(url)
+        assert [user.username for user in response.context['staff']] == ['admin']
+        assert len(response.context['non_staff']) == 50
+        assert len(response.context['user_list']) == 50
+        cursor = response.context['non_staff'].next_cursor
+        self.assertContains(response, f'non_staff_cursor={cursor}')
+
+        response = self.client.get(url, {'non_staff_cursor': cursor})
+        assert [user.username for user in response.context['non_staff']] == [f'user{i}' for i in range(50, 60)]
+        assert [user.username for user in response.context['staff']] == ['admin']
+
+    def test_query_count_independent_of_users(self):
+        password = 'password'
+        admin = User.objects.create_superuser(username='admin', password=password)
+        self.client.login(username=admin.username, password=password)
+        url = reverse('polls:user_list')
+
+        for i in range(3):
+            User.objects.create_user(username=f'user{i}')
+        self.client.get(url)  # cache the session and the logged in user
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        for i in range(3, 40):
+            User.objects.create_user(username=f'user{i}')
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+        assert len(few) == len(many)
+
+
+class VoteBufferTests(TestCase):
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir)
+
+    def test_flush_applies_batched_updates(self):
+        question = create_question(question_text='Past question', days=-5)
+        first, second = question.choice_set.all()
+        buffer = VoteBuffer(self.journal_dir, max_votes=3, max_age=0)
+        buffer.add(first.pk)
+        buffer.add(second.pk)
+        assert buffer.pending() == {first.pk: 1, second.pk: 1}
+        buffer.add(first.pk)  # reaches max_votes
+        first.refresh_from_db()
+        second.refresh_from_db()
+        assert (first.votes, second.votes) == (2, 1)
+        assert buffer.pending() == {}
+
+    def test_failed_flush_keeps_votes(self):
+        buffer = VoteBuffer(self.journal_dir, max_votes=100, max_age=0, apply=mock.Mock(side_effect=RuntimeError))
+        buffer.add(1)
+        with self.assertRaises(RuntimeError):
+            buffer.flush()
+        assert buffer.pending() == {1: 1}
+        with open(buffer.journal_path) as f:
+            assert f.read() == '1\n'
+
+    def test_recover_journal_of_dead_process(self):
+        question = create_question(question_text='Past question', days=-5)
+        choice = question.choice_set.first()
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        with open(os.path.join(self.journal_dir, f'votes-{dead.pid}.log'), 'w') as f:
+            f.write(f'{choice.pk}\n{choice.pk}\n')
+
+        assert recover_journals(self.journal_dir) == 2
+        choice.refresh_from_db()
+        assert choice.votes == 2
+        assert os.listdir(self.journal_dir) == []
+
+    def test_recover_journal_of_earlier_process_with_same_pid(self):
+        question = create_question(question_text='Past question', days=-5)
+        choice = question.choice_set.first()
+        buffer = VoteBuffer(self.journal_dir, max_votes=100, max_age=0)
+        buffer.add(choice.pk)
+        # Left behind by a crashed process that had our PID, e.g. PID 1 in a container.
+        for name in [f'votes-{os.getpid()}.log', f'votes-{os.getpid()}-0123abcd-0123abcd.log.1.pending']:
+            with open(os.path.join(self.journal_dir, name), 'w') as f:
+                f.write(f'{choice.pk}\n')
+
+        assert recover_journals(self.journal_dir) == 2
+        assert os.listdir(self.journal_dir) == [os.path.basename(buffer.journal_path)]
+        assert buffer.flush() == 1
+        choice.refresh_from_db()
+        assert choice.votes == 3
+
+
+class VoteBufferThreadTests(TransactionTestCase):
+    """Flushes from other threads, which need their own database connections."""
+
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    def test_concurrent_votes_are_not_lost(self):
+        question = create_question(question_text='Past question', days=-5, nchoices=3)
+        choices = list(question.choice_set.order_by('pk'))
+        buffer = VoteBuffer(self.journal_dir, max_votes=37, max_age=0)
+
+        def worker(choice):
+            try:
+                for _ in range(100):
+                    buffer.add(choice.pk)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=[choices[i % 3]]) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        buffer.flush()
+
+        assert [choice.votes for choice in question.choice_set.order_by('pk')] == [300, 300, 200]
+        assert os.listdir(self.journal_dir) == []
+
+    def test_timed_flush(self):
+        question = create_question(question_text='Past question', days=-5)
+        choice = question.choice_set.first()
+        applied = threading.Event()
+
+        def apply(counts):
+            apply_vote_counts(counts)
+            applied.set()
+
+        buffer = VoteBuffer(self.journal_dir, max_votes=100, max_age=0.05, apply=apply)
+        buffer.add(choice.pk)
+        # Don't read while the timer's thread writes, SQLite's shared in-memory test database would be locked.
+        assert applied.wait(5)
+        choice.refresh_from_db()
+        assert choice.votes == 1
+        assert buffer.pending() == {}
+        self.wait_for(lambda: not os.listdir(self.journal_dir))
+
+    def test_failed_timed_flush_is_retried(self):
+        apply = mock.Mock(side_effect=[RuntimeError, None])
+        buffer = VoteBuffer(self.journal_dir, max_votes=100, max_age=0.05, apply=apply)
+        with mock.patch('threading.excepthook'):
+            buffer.add(1)
+            self.wait_for(lambda: apply.call_count == 2)
+        assert apply.call_args_list == [mock.call({1: 1}), mock.call({1: 1})]
+        self.wait_for(lambda: not buffer.pending())
+
+
+class LiveResultsTests(TestCase):
+    def setUp(self):
+        self.broker = LocalBroker()
+        self.app = LiveResultsApp(mock.AsyncMock(), broker=self.broker)
+
+    def connect(self, question_id, root_path=''):
+        path = f'{root_path}/polls/{question_id}/live/'
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'root_path': root_path, 'headers': []}
+        return ApplicationCommunicator(self.app, scope)
+
+    @override_settings(POLLS_LIVE_COALESCE_INTERVAL=0.05)
+    def test_coalesced_votes(self):
+        question = create_question(question_text='Past question', days=-5)
+        first, second = question.choice_set.all()
+
+        async def watch():
+            communicator = self.connect(question.pk)
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(1)
+            assert start['status'] == 200
+            assert (await communicator.receive_output(1))['body'] == b': connected\n\n'
+            for choice in [first, second, first]:
+                self.broker.publish(question.pk, choice.pk)
+            event = (await communicator.receive_output(1))['body'].decode()
+            await communicator.send_input({'type': 'http.disconnect'})
+            await communicator.wait(1)
+            return event
+
+        event = async_to_sync(watch)()
+        assert event == f'event: votes\ndata: {{"{first.pk}": 2, "{second.pk}": 1}}\n\n'
+        assert self.broker._subscribers == {}
+
+    def test_vote_is_published(self):
+        password = 'password'
+        user = User.objects.create_user(username='user', password=password)
+        self.client.login(username=user.username, password=password)
+        question = create_question(question_text='Past question', days=-5)
+        choice = question.choice_set.first()
+        with mock.patch('polls.live._broker') as broker:
+            self.client.post(reverse('polls:vote', args=[question.pk]), data={'choice': choice.pk})
+        broker.publish.assert_called_once_with(question.pk, choice.pk)
+
+    def test_hidden_question(self):
+        question = create_question(question_text='Future question', days=5)
+
+        async def watch():
+            communicator = self.connect(question.pk)
+            await communicator.send_input({'type': 'http.request'})
+            return (await communicator.receive_output(1))['status']
+
+        assert async_to_sync(watch)() == 404
+
+    @override_settings(POLLS_LIVE_MAX_CONNECTIONS=0)
+    def test_connection_limit(self):
+        async def watch():
+            communicator = self.connect(1)
+            await communicator.send_input({'type': 'http.request'})
+            return await communicator.receive_output(1)
+
+        start = async_to_sync(watch)()
+        assert start['status'] == 503
+        assert (b'retry-after', b'30') in start['headers']
+
+    def test_root_path(self):
+        question = create_question(question_text='Future question', days=5)
+
+        async def watch():
+            communicator = self.connect(question.pk, root_path='/mysite')
+            await communicator.send_input({'type': 'http.request'})
+            return (await communicator.receive_output(1))['status']
+
+        assert async_to_sync(watch)() == 404
+        self.app.app.assert_not_awaited()
+
+    def test_other_paths_pass_through(self):
+        async def call(path):
+            await self.app({'type': 'http', 'path': path}, None, None)
+
+        for path in ['/polls/', '/polls/1/results/live/', '/polls/live/', '/other/1/live/']:
+            async_to_sync(call)(path)
+        assert self.app.app.await_count == 4
+
+    def test_broker_interface(self):
+        class PublishOnly(Broker):
+            def publish(self, question_id, choice_id):
+                pass
+
+        with self.assertRaises(TypeError):
+            PublishOnly()
+
+
+class ImportPollsTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_jsonl(self):
+        rows = [
+            {'model': 'question', 'id': 7, 'question_text': 'Imported?', 'pub_date': '2020-06-01T10:00:00'},
+            {'model': 'choice', 'question': 7, 'choice_text': 'Yes', 'votes': '3'},
+            {'model': 'choice', 'question': 7, 'choice_text': 'No'},
+            {'model': 'comment', 'question': 7, 'author': 'anon', 'text': 'Sure'},
+        ]
+        path = self.write('polls.jsonl', ''.join(json.dumps(row) + '\n' for row in rows))
+        out = io.StringIO()
+        call_command('import_polls', path, batch_size=3, stdout=out)
+
+        question = Question.objects.get(pk=7)
+        assert timezone.is_aware(question.pub_date)
+        assert [(c.choice_text, c.votes) for c in question.choice_set.all()] == [('Yes', 3), ('No', 0)]
+        assert question.comment_set.get().text == 'Sure'
+        assert 'Imported 4 rows' in out.getvalue()
+
+    def test_csv(self):
+        question = create_question(question_text='Past question', days=-5, nchoices=0)
+        path = self.write('choices.csv', f'question,choice_text\n{question.pk},Yes\n{question.pk},No\n')
+        call_command('import_polls', path, model='choice', stdout=io.StringIO())
+        assert sorted(question.choice_set.values_list('choice_text', flat=True)) == ['No', 'Yes']
+
+    def test_missing_question(self):
+        path = self.write('polls.jsonl', json.dumps({'model': 'choice', 'question': 1, 'choice_text': 'Yes'}))
+        with self.assertRaises(CommandError):
+            call_command('import_polls', path, stdout=io.StringIO())
+        assert not Choice.objects.exists()
+
+    def test_question_without_id(self):
+        row = {'model': 'question', 'question_text': 'Question', 'pub_date': '2020-06-01T10:00:00'}
+        path = self.write('polls.jsonl', json.dumps(row))
+        with self.assertRaisesMessage(CommandError, 'Row 1: questions need an id'):
+            call_command('import_polls', path, stdout=io.StringIO())
+
+    def test_resume_from_checkpoint(self):
+        question = create_question(question_text='Past question', days=-5, nchoices=0)
+        rows = [{'model': 'choice', 'question': question.pk, 'choice_text': f'Choice {i}'} for i in range(5)]
+        rows.insert(4, {'model': 'choice', 'question': 999, 'choice_text': 'Missing question'})
+        path = self.write('choices.jsonl', ''.join(json.dumps(row) + '\n' for row in rows))
+
+        # The second batch fails, the first one is committed with its checkpoint.
+        with self.assertRaises(CommandError):
+            call_command('import_polls', path, batch_size=3, checkpoint='choices', stdout=io.StringIO())
+        assert Checkpoint.objects.get(name='import:choices').last_id == 3
+
+        rows[4]['question'] = question.pk
+        self.write('choices.jsonl', ''.join(json.dumps(row) + '\n' for row in rows))
+        call_command('import_polls', path, batch_size=3, checkpoint='choices', stdout=io.StringIO())
+        assert question.choice_set.count() == 6
+        assert not Checkpoint.objects.exists()
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        password = 'password'
+        admin = User.objects.create_superuser(username='admin', password=password)
+        self.client.login(username=admin.username, password=password)
+        self.old = create_question(question_text='Old question', days=-30, nchoices=1)
+        self.new = create_question(question_text='New question', days=-1, nchoices=1)
+        Comment.objects.create(question=self.new, author='anon', text='Hi')
+
+    def test_staff_only(self):
+        self.client.logout()
+        response = self.client.get(reverse('polls:export', args=['results']))
+        assert response.status_code == 302
+
+    def test_results_csv(self):
+        response = self.client.get(reverse('polls:export', args=['results']))
+        assert response.streaming
+        assert response['Content-Type'] == 'text/csv'
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        assert lines[0] == 'question_id,question__question_text,question__pub_date,id,choice_text,total_votes'
+        assert len(lines) == 3
+
+    def test_comments_ndjson_since_gzip(self):
+        since = (timezone.now() - datetime.timedelta(days=7)).date().isoformat()
+        response = self.client.get(
+            reverse('polls:export', args=['comments']), {'format': 'ndjson', 'since': since, 'gzip': '1'}
+        )
+        assert response['Content-Disposition'] == 'attachment; filename="comments.ndjson.gz"'
+        rows = [json.loads(line) for line in gzip.decompress(b''.join(response.streaming_content)).splitlines()]
+        assert [(row['question_id'], row['text']) for row in rows] == [(self.new.pk, 'Hi')]
+
+    def test_same_datetimes_in_both_formats(self):
+        response = self.client.get(reverse('polls:export', args=['comments']))
+        csv_date = b''.join(response.streaming_content).decode().splitlines()[1].split(',')[-1]
+        response = self.client.get(reverse('polls:export', args=['comments']), {'format': 'ndjson'})
+        ndjson_date = json.loads(b''.join(response.streaming_content))['created_date']
+        assert csv_date == ndjson_date == Comment.objects.get().created_date.isoformat()
+
+    def test_bad_requests(self):
+        assert self.client.get(reverse('polls:export', args=['users'])).status_code == 404
+        response = self.client.get(reverse('polls:export', args=['results']), {'since': 'yesterday'})
+        assert response.status_code == 400
+
+    def test_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'results.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        until = (timezone.now() - datetime.timedelta(days=7)).isoformat()
+        call_command('export_polls', 'results', until=until, output=path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        assert len(lines) == 2
+        assert 'Old question' in lines[1]
+
+
+class BenchmarkRoutesTests(TestCase):
+    def test_every_route_covered(self):
+        requests = benchmark_routes.route_requests({'questions': [1], 'choices': {1: [1]}, 'users': [1]}, 0)
+        assert {pattern.name for pattern in urlpatterns} <= set(requests)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert benchmark_routes.percentile(values, 50) == 51
+        assert benchmark_routes.percentile(values, 99) == 99
+
+    def test_compare_with_baseline(self):
+        baseline = {'index': {'p95': 10.0, 'queries': 2}}
+        path = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            json.dump(baseline, f)
+        command = benchmark_routes.Command(stdout=io.StringIO())
+
+        command.compare({'index': {'p95': 12.0, 'queries': 2}}, path, tolerance=0.25)
+        with self.assertRaisesRegex(CommandError, 'index: p95'):
+            command.compare({'index': {'p95': 13.0, 'queries': 2}}, path, tolerance=0.25)
+        with self.assertRaisesRegex(CommandError, 'index: 3 queries'):
+            command.compare({'index': {'p95': 10.0, 'queries': 3}}, path, tolerance=0.25)
+
+
+@override_settings(POLLS_INSTRUMENTATION=True)
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        route_stats.reset()
+        self.addCleanup(route_stats.reset)
+        self.question = create_question(question_text='Question', days=-1, nchoices=2)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('polls:results', args=[self.question.pk]))
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'tpl;dur=', 'view;dur=', 'total;dur='):
+            assert metric in timing
+        assert 'desc="0 queries"' not in timing
+
+    def test_no_server_timing_for_others(self):
+        response = self.client.get(reverse('polls:index'), REMOTE_ADDR='203.0.113.1')
+        assert not response.has_header('Server-Timing')
+        assert route_stats.snapshot()['routes']['polls:index']['count'] == 1
+
+    def test_route_histograms(self):
+        for _ in range(3):
+            self.client.get(reverse('polls:results', args=[self.question.pk]))
+        stats = route_stats.snapshot()['routes']['polls:results']
+        assert stats['count'] == 3
+        assert sum(stats['buckets']) == 3
+        assert stats['queries'] > 0
+        assert stats['p95_ms'] >= stats['p50_ms']
+
+    @override_settings(POLLS_PROFILE_SAMPLE_RATE=1.0)
+    def test_sampled_profile(self):
+        self.client.get(reverse('polls:index'))
+        [profile] = route_stats.snapshot()['profiles']
+        assert profile['route'] == 'polls:index'
+        assert 'cumulative' in profile['stats']
+
+    @override_settings(POLLS_INSTRUMENTATION=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('polls:index'))
+        assert not response.has_header('Server-Timing')
+        assert route_stats.snapshot()['routes'] == {}
+
+    def test_stats_staff_only(self):
+        response = self.client.get(reverse('polls:stats'))
+        assert response.status_code == 302
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        self.client.get(reverse('polls:index'))
+        data = self.client.get(reverse('polls:stats')).json()
+        assert data['routes']['polls:index']['count'] == 1
+
+
+@override_settings(POLLS_DB_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Question', days=-1, nchoices=2)
+        # Stand in for the replicas with the default database and count the reads sent to them.
+        patcher = mock.patch('polls.routers.random.choice', return_value='default')
+        self.replica_reads = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_primary_outside_requests(self):
+        assert ReplicaRouter().db_for_read(Question) == 'default'
+        assert not self.replica_reads.called
+
+    def test_write_pins_request(self):
+        router = ReplicaRouter()
+        state, token = start_request()
+        try:
+            router.db_for_read(Question)
+            assert self.replica_reads.call_count == 1
+            assert router.db_for_write(Question) == 'default'
+            router.db_for_read(Question)
+            assert self.replica_reads.call_count == 1
+        finally:
+            end_request(token)
+        assert state.wrote
+
+    def test_one_replica_per_request(self):
+        router = ReplicaRouter()
+        for _ in range(2):
+            state, token = start_request()
+            try:
+                assert {router.db_for_read(Question), router.db_for_read(Choice)} == {'default'}
+            finally:
+                end_request(token)
+        assert self.replica_reads.call_count == 2
+
+    def test_read_your_writes(self):
+        self.client.get(reverse('polls:results', args=[self.question.pk]))
+        assert self.replica_reads.called
+        assert PIN_COOKIE not in self.client.cookies
+
+        User.objects.create_user(username='voter', password='password')
+        self.client.login(username='voter', password='password')
+        self.replica_reads.reset_mock()
+        choice = self.question.choice_set.first()
+        response = self.client.post(reverse('polls:vote', args=[self.question.pk]), {'choice': choice.pk})
+        assert response.cookies[PIN_COOKIE]['max-age'] == 10
+        response = self.client.get(response.url)
+        assert not self.replica_reads.called
+        assert response.context['choices'].get(pk=choice.pk).total_votes == 1
+
+    @override_settings(POLLS_DB_REPLICAS=[])
+    def test_no_replicas(self):
+        url = reverse('polls:add_comment', args=[self.question.pk])
+        response = self.client.post(url, {'author': 'a', 'text': 'b'})
+        assert PIN_COOKIE not in response.cookies
+
+
+@override_settings(POLLS_RATE_LIMIT_USER='2/60', POLLS_RATE_LIMIT_IP='3/60')
+class RateLimitTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Question', days=-1, nchoices=1)
+        self.url = reverse('polls:add_comment', args=[self.question.pk])
+        self.data = {'author': 'anon', 'text': 'Hi'}
+
+    def test_per_user(self):
+        User.objects.create_user(username='user', password='password')
+        self.client.login(username='user', password='password')
+        for _ in range(2):
+            assert self.client.post(self.url, self.data).status_code == 302
+        response = self.client.post(self.url, self.data)
+        assert response.status_code == 429
+        assert 1 <= int(response['Retry-After']) <= 30
+        assert Comment.objects.count() == 2
+        # Reading the form isn't limited.
+        assert self.client.get(self.url).status_code == 200
+
+    def test_per_ip(self):
+        for _ in range(3):
+            assert self.client.post(self.url, self.data).status_code == 302
+        assert self.client.post(self.url, self.data).status_code == 429
+        assert self.client.post(self.url, self.data, REMOTE_ADDR='10.0.0.1').status_code == 302
+
+    def test_rejected_request_takes_no_user_token(self):
+        for _ in range(3):
+            self.client.post(self.url, self.data)
+        User.objects.create_user(username='user', password='password')
+        self.client.login(username='user', password='password')
+        assert self.client.post(self.url, self.data).status_code == 429
+        for _ in range(2):
+            assert self.client.post(self.url, self.data, REMOTE_ADDR='10.0.0.1').status_code == 302
+
+    def test_tokens_refill(self):
+        with mock.patch('polls.ratelimit.time.time', return_value=1000.0):
+            for _ in range(3):
+                self.client.post(self.url, self.data)
+            assert self.client.post(self.url, self.data).status_code == 429
+        with mock.patch('polls.ratelimit.time.time', return_value=1020.0):
+            assert self.client.post(self.url, self.data).status_code == 302
+            assert self.client.post(self.url, self.data).status_code == 429
+
+    @override_settings(POLLS_SHED_WRITE_LATENCY=0.5, POLLS_SHED_SECONDS=5)
+    def test_shed_writes(self):
+        write_latency.record(0.1)
+        assert not cache.get(SHED_KEY)
+        for _ in range(10):
+            write_latency.record(2.0)
+        assert cache.get(SHED_KEY)
+        assert write_latency.average < 0.5
+
+        response = self.client.post(self.url, self.data)
+        assert response.status_code == 503
+        assert response['Retry-After'] == '5'
+        assert self.client.get(reverse('polls:question', args=[self.question.pk])).status_code == 200
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.pizza = create_question(question_text='Best pizza topping?', days=-1)
+        self.pasta = create_question(question_text='Best pasta shape?', days=-2)
+        Comment.objects.create(question=self.pasta, author='anon', text='Pizza is overrated')
+
+    def test_index_available(self):
+        assert search_available('default')
+
+    def test_match_expression(self):
+        assert match_expression('pizza "top') == '"pizza" "top"*'
+        assert match_expression(' -* ') == ''
+
+    def test_ranked_question_and_comment_matches(self):
+        assert search_questions('pizza') == [self.pizza, self.pasta]
+        assert search_questions('pizza overrated') == [self.pasta]
+        assert search_questions('toppings') == [self.pizza]  # stemmed
+        assert search_questions('sha') == [self.pasta]  # prefix
+
+    def test_kept_in_sync(self):
+        self.pizza.question_text = 'Best burger?'
+        self.pizza.save()
+        Comment.objects.filter(question=self.pasta).update(text='Burgers!')
+        assert search_questions('pizza') == []
+        assert set(search_questions('burger')) == {self.pizza, self.pasta}
+        self.pizza.delete()
+        assert search_questions('burger') == [self.pasta]
+
+    def test_hidden_questions(self):
+        future = create_question(question_text='Future pizza', days=5)
+        no_choices = create_question(question_text='Pizza without choices', days=-1, nchoices=0)
+        results = search_questions('pizza')
+        assert future not in results and no_choices not in results
+
+    def test_hidden_questions_dont_use_up_limit(self):
+        for i in range(3):
+            create_question(question_text=f'Pizza pizza pizza {i}', days=5)
+        assert search_questions('pizza', limit=2) == [self.pizza, self.pasta]
+
+    def test_fallback(self):
+        with mock.patch('polls.search.search_available', return_value=False):
+            assert search_questions('pizza') == [self.pizza, self.pasta]
+            assert search_questions('overrated') == [self.pasta]
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM polls_search')
+        assert search_questions('pizza') == []
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        assert search_questions('pizza') == [self.pizza, self.pasta]
+
+    def test_view_paginates(self):
+        for i in range(11):
+            create_question(question_text=f'Pizza {i}', days=-1)
+        response = self.client.get(reverse('polls:search'), {'q': 'pizza'})
+        assert len(response.context['questions']) == 10
+        assert 'page=2' in response.content.decode()
+        response = self.client.get(reverse('polls:search'), {'q': 'pizza', 'page': 2})
+        assert len(response.context['questions']) == 3
+
+    def test_admin_search(self):
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('admin:polls_question_changelist'), {'q': 'overrated'})
+        assert list(response.context['cl'].result_list) == [self.pasta]
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        self.question = create_question(question_text='Question', days=-1)
+
+    def add_rows(self, n):
+        for i in range(n):
+            user = User.objects.create_user(username=f'user{User.objects.count()}')
+            question = create_question(question_text=f'Question {i}', days=-1)
+            choice = question.choice_set.first()
+            Comment.objects.create(question=question, author='anon', text='Hi')
+            Vote.objects.create(user=user, question=question, choice=choice)
+
+    def assert_bounded(self, url):
+        """The page needs as many queries with few rows as with more rows."""
+        self.client.get(url)  # warm up the content type cache
+        self.add_rows(2)
+        with CaptureQueriesContext(connection) as few:
+            assert self.client.get(url).status_code == 200
+        self.add_rows(5)
+        with CaptureQueriesContext(connection) as more:
+            assert self.client.get(url).status_code == 200
+        assert len(few) == len(more)
+
+    def test_changelists_bounded(self):
+        for model in ('question', 'choice', 'profile', 'comment', 'vote'):
+            with self.subTest(model=model):
+                self.assert_bounded(reverse(f'admin:polls_{model}_changelist'))
+
+    def test_change_forms_bounded(self):
+        Comment.objects.create(question=self.question, author='anon', text='Hi')
+        Vote.objects.create(user=self.admin, question=self.question, choice=self.question.choice_set.first())
+        for model in (Choice, Profile, Comment, Vote):
+            with self.subTest(model=model):
+                url = reverse(f'admin:polls_{model._meta.model_name}_change', args=[model.objects.first().pk])
+                self.assert_bounded(url)
+
+    def test_votes_not_deletable(self):
+        vote = Vote.objects.create(user=self.admin, question=self.question, choice=self.question.choice_set.first())
+        response = self.client.post(reverse('admin:polls_vote_delete', args=[vote.pk]), {'post': 'yes'})
+        assert response.status_code == 403
+        assert Vote.objects.filter(pk=vote.pk).exists()
+
+    @override_settings(POLLS_ADMIN_MAX_INLINES=3)
+    def test_bounded_choice_inline(self):
+        for i in range(5):
+            Choice.objects.create(question=self.question, choice_text=f'Extra {i}', votes=i)
+        # The first choices by pk, ordered by votes.
+        Choice.objects.filter(choice_text='Choice 2').update(votes=1)
+        response = self.client.get(reverse('admin:polls_question_change', args=[self.question.pk]))
+        formset = response.context['inline_admin_formsets'][0].formset
+        assert [form.instance.choice_text for form in formset.initial_forms] == ['Choice 2', 'Choice 1', 'Extra 0']
+        assert formset.hidden_count == 4
+        url = f"{reverse('admin:polls_choice_changelist')}?question__id__exact={self.question.pk}"
+        self.assertContains(response, f'<a href="{url}">4 more choices</a>', html=True)
+        assert self.client.get(url).context['cl'].result_count == 7
+
+    def test_choices_show_sharded_votes(self):
+        first, second = self.question.choice_set.order_by('pk')
+        Choice.objects.filter(pk=first.pk).update(votes=1)
+        for _ in range(2):
+            ChoiceShard.increment(second.pk, shards=4)
+        response = self.client.get(reverse('admin:polls_question_change', args=[self.question.pk]))
+        formset = response.context['inline_admin_formsets'][0].formset
+        assert [form.instance.pk for form in formset.initial_forms] == [second.pk, first.pk]
+        response = self.client.get(reverse('admin:polls_choice_changelist'), {'o': '-3'})
+        assert [choice.total_votes for choice in response.context['cl'].result_list] == [2, 1]
+
+    @override_settings(POLLS_ADMIN_MAX_INLINES=2)
+    def test_bounded_choice_inline_edit_while_voting(self):
+        first, second = self.question.choice_set.order_by('pk')
+        Choice.objects.filter(pk=first.pk).update(votes=1)
+        Choice.objects.create(question=self.question, choice_text='Choice 3', votes=2)
+        url = reverse('admin:polls_question_change', args=[self.question.pk])
+        formset = self.client.get(url).context['inline_admin_formsets'][0].formset
+        data = {
+            'question_text': self.question.question_text,
+            'pub_date_0': self.question.pub_date.strftime('%Y-%m-%d'),
+            'pub_date_1': self.question.pub_date.strftime('%H:%M:%S'),
+        }
+        for name, value in formset.management_form.initial.items():
+            data[f'{formset.prefix}-{name}'] = value
+        # Leave out the empty extra forms.
+        data[f'{formset.prefix}-TOTAL_FORMS'] = len(formset.initial_forms)
+        for form in formset.initial_forms:
+            for name in ('id', 'question', 'choice_text', 'votes'):
+                data[form.add_prefix(name)] = form[name].value()
+            if form.instance == first:
+                data[form.add_prefix('choice_text')] = 'Edited'
+
+        # Votes come in between rendering and posting the form.
+        Choice.objects.filter(pk=second.pk).update(votes=10)
+        assert self.client.post(url, data).status_code == 302
+        first.refresh_from_db()
+        assert first.choice_text == 'Edited'
+
+    @override_settings(POLLS_ADMIN_EXACT_COUNT_LIMIT=3)
+    def test_estimated_count(self):
+        self.add_rows(5)
+        Question.objects.filter(question_text='Question 0').delete()
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('admin:polls_question_changelist'))
+        assert not [query for query in captured if 'COUNT(*)' in query['sql']]
+        assert response.context['cl'].result_count == Question.objects.latest('pk').pk
+        response = self.client.get(reverse('admin:polls_question_changelist'), {'q': 'question'})
+        assert response.context['cl'].result_count == 5
+
+
+class ProvisioningTests(TestCase):
+    def test_provision_users(self):
+        rows = [{'username': f'user{i}', 'password': f'secret{i}'} for i in range(5)]
+        rows[0].update(is_staff=True, bio='Team lead')
+        assert provision_users(rows, batch_size=2, workers=0) == 5
+
+        users = User.objects.select_related('profile').order_by('username')
+        assert [user.username for user in users] == [f'user{i}' for i in range(5)]
+        assert all(user.profile for user in users)
+        assert users[0].is_staff and users[0].profile.bio == 'Team lead'
+        assert users[1].check_password('secret1')
+
+    def test_taken_usernames(self):
+        User.objects.create_user(username='user1')
+        rows = [{'username': name, 'password': None} for name in ('user0', 'user1', 'user2', 'user2')]
+        with self.assertRaisesRegex(ValueError, 'user1, user2'):
+            provision_users(rows, workers=0)
+        assert User.objects.count() == 1
+
+    def test_hash_in_processes(self):
+        hashes = hash_passwords(['one', 'two'], workers=2)
+        assert User(password=hashes[1]).check_password('two')
+
+    def test_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'users.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('username,password,is_staff\nann,pw1,true\nbob,,\n')
+        out = io.StringIO()
+        call_command('provision_users', path, '--workers', '0', '--compare', '2', stdout=out)
+        assert 'create_user(): 2 users' in out.getvalue()
+        assert 'Provisioned 2 users' in out.getvalue()
+        ann, bob = User.objects.order_by('username')
+        assert ann.is_staff and ann.check_password('pw1')
+        assert not bob.has_usable_password()
+        assert Profile.objects.count() == 2
+
+    def test_command_empty_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'users.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('username,password\n')
+        out = io.StringIO()
+        call_command('provision_users', path, '--workers', '0', '--compare', '2', stdout=out)
+        assert 'No users to provision' in out.getvalue()
+
+
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password')
+        self.client.login(username='user', password='password')
+        self.client.get(reverse('polls:index'))
+
+    def auth_queries(self):
+        """Session and user queries of a request to a page that doesn't otherwise need them."""
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('polls:index'))
+        assert response.context['user'].is_authenticated
+        return [query['sql'] for query in captured if 'django_session' in query['sql'] or 'auth_user' in query['sql']]
+
+    def test_cached(self):
+        assert self.auth_queries() == []
+        assert self.client.get(reverse('polls:index')).context['user'].profile.bio == 'Please add a profile'
+
+    def test_invalidated_by_profile_save(self):
+        self.user.profile.bio = 'Updated'
+        self.user.profile.save()
+        assert len(self.auth_queries()) == 1
+        assert self.auth_queries() == []
+
+    def test_password_change_ends_sessions(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('changed')
+        user.save()
+        response = self.client.get(reverse('polls:index'))
+        assert not response.context['user'].is_authenticated
+
+    def test_logout(self):
+        self.client.get(reverse('logout'))
+        assert cache.get(user_key(self.user.pk)) is None
+
+    def test_session_of_model_backend(self):
+        # Started before CachedModelBackend was deployed.
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        assert self.client.get(reverse('polls:index')).context['user'] == self.user
+
+    def test_failed_login_hashes_once(self):
+        self.client.logout()
+        with mock.patch.object(
+            PBKDF2PasswordHasher, 'encode', autospec=True, side_effect=PBKDF2PasswordHasher.encode
+        ) as encode:
+            assert not self.client.login(username='user', password='wrong')
+            assert not self.client.login(username='nobody', password='password')
+        assert encode.call_count == 2
+        assert self.client.login(username='user', password='password')
+
+    def test_clear_expired_sessions(self):
+        Session.objects.create(session_key='old', session_data='', expire_date=timezone.now() - datetime.timedelta(1))
+        out = io.StringIO()
+        call_command('clear_expired_sessions', '--batch-size', '1', stdout=out)
+        assert 'Deleted 1 expired sessions' in out.getvalue()
+        assert Session.objects.count() == 1
+
+
+class QuestionStatsTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Question', days=-1, nchoices=3)
+        self.choices = list(self.question.choice_set.order_by('pk'))
+
+    def vote(self, choice, username):
+        user = User.objects.create_user(username=username, password='password')
+        self.client.force_login(user)
+        self.client.post(reverse('polls:vote', args=[self.question.pk]), {'choice': choice.pk})
+
+    def test_created_with_question(self):
+        stats = QuestionStats.objects.get(question=self.question)
+        assert (stats.total_votes, stats.choice_count, stats.comment_count) == (0, 3, 0)
+
+    def test_votes_and_comments(self):
+        first, second, _ = self.choices
+        self.vote(first, 'a')
+        self.vote(second, 'b')
+        self.vote(second, 'c')
+        Comment.objects.create(question=self.question, author='anon', text='Hi')
+        stats = QuestionStats.objects.get(question=self.question)
+        assert (stats.total_votes, stats.leader_id, stats.leader_votes) == (3, second.pk, 2)
+        assert stats.comment_count == 1
+        assert QuestionStats.reconcile([self.question.pk]) == 0
+
+        response = self.client.get(reverse('polls:results', args=[self.question.pk]))
+        self.assertContains(response, '<tr class="table-success">\n        <td>Choice 2</td>', html=False)
+        self.assertContains(response, '<td>67</td>')
+        self.assertContains(response, '3 votes, 1 comment')
+
+    def test_buffered_votes_counted_on_flush(self):
+        first, second, _ = self.choices
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir)
+        buffer = VoteBuffer(journal_dir, max_votes=100, max_age=0)
+        for choice in [first, second, second]:
+            buffer.add(choice.pk)
+        buffer.flush()
+        stats = QuestionStats.objects.get(question=self.question)
+        assert (stats.total_votes, stats.leader_id, stats.leader_votes) == (3, second.pk, 2)
+        assert QuestionStats.reconcile([self.question.pk]) == 0
+
+    def test_reconcile_command(self):
+        Choice.objects.filter(pk=self.choices[2].pk).update(votes=5)
+        QuestionStats.objects.filter(pk=self.question.pk).update(comment_count=7)
+        other = create_question(question_text='Other', days=-1)
+        QuestionStats.objects.filter(pk=other.pk).delete()
+
+        out = io.StringIO()
+        call_command('reconcile_question_stats', '--batch-size', '1', stdout=out)
+        assert 'Checked 2 questions, repaired 2' in out.getvalue()
+        stats = QuestionStats.objects.get(question=self.question)
+        assert (stats.total_votes, stats.leader_id, stats.comment_count) == (5, self.choices[2].pk, 0)
+        assert QuestionStats.objects.filter(question=other).exists()
+
+    def test_question_delete(self):
+        Comment.objects.create(question=self.question, author='anon', text='Hi')
+        self.question.delete()
+        assert not QuestionStats.objects.exists()
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Question', days=-5)
+        self.first, self.second = self.question.choice_set.order_by('pk')
+        self.now = timezone.localtime().replace(minute=30, second=0, microsecond=0)
+
+    def add_event(self, choice, hours_ago):
+        created = self.now - datetime.timedelta(hours=hours_ago)
+        return VoteEvent.objects.create(question=self.question, choice=choice, created_date=created)
+
+    def rollups(self, period):
+        return {
+            (rollup.choice_id, rollup.start): rollup.votes
+            for rollup in VoteRollup.objects.filter(period=period)
+        }
+
+    def test_vote_logs_event(self):
+        user = User.objects.create_user(username='user', password='password')
+        self.client.force_login(user)
+        self.client.post(reverse('polls:vote', args=[self.question.pk]), {'choice': self.first.pk})
+        assert VoteEvent.objects.get().choice == self.first
+
+    def test_incremental_rollup(self):
+        self.add_event(self.first, 1)
+        self.add_event(self.first, 1)
+        self.add_event(self.second, 2)
+        assert rollup_votes(batch_size=2) == 3
+        hour = self.now.replace(minute=0) - datetime.timedelta(hours=1)
+        assert self.rollups(VoteRollup.HOUR)[self.first.pk, hour] == 2
+        assert sum(self.rollups(VoteRollup.DAY).values()) == 3
+
+        assert rollup_votes() == 0
+        self.add_event(self.first, 1)
+        assert rollup_votes() == 1
+        assert self.rollups(VoteRollup.HOUR)[self.first.pk, hour] == 3
+
+    def test_recent_events_wait(self):
+        VoteEvent.objects.create(question=self.question, choice=self.first)
+        assert rollup_votes() == 0
+
+    def test_events_after_recent_event_wait(self):
+        recent = VoteEvent.objects.create(question=self.question, choice=self.first)
+        self.add_event(self.second, 1)  # higher id, but older
+        assert rollup_votes() == 0
+        recent.created_date = self.now - datetime.timedelta(hours=1)
+        recent.save()
+        assert rollup_votes() == 2
+        assert sum(self.rollups(VoteRollup.DAY).values()) == 2
+
+    @override_settings(POLLS_VOTE_EVENT_RETENTION_DAYS=1)
+    def test_prune(self):
+        self.add_event(self.first, 48)
+        self.add_event(self.first, 1)
+        assert prune_vote_events() == 0  # not rolled up yet
+        rollup_votes()
+        assert prune_vote_events() == 1
+        assert VoteEvent.objects.count() == 1
+        assert sum(self.rollups(VoteRollup.DAY).values()) == 2
+
+    def test_trends(self):
+        self.add_event(self.first, 1)
+        self.add_event(self.second, 1)
+        self.add_event(self.second, 26)
+        rollup_votes()
+        VoteEvent.objects.all().delete()
+
+        data = self.client.get(reverse('polls:trends', args=[self.question.pk]), {'period': 'hour'}).json()
+        assert data['period'] == 'hour'
+        buckets = {choice['id']: len(choice['votes']) for choice in data['choices']}
+        assert buckets == {self.first.pk: 1, self.second.pk: 2}
+        assert self.client.get(reverse('polls:trends', args=[self.question.pk]), {'period': 'year'}).status_code == 400
+
+        response = self.client.get(reverse('polls:results', args=[self.question.pk]))
+        assert sum(day['votes'] for day in response.context['daily_votes']) == 3
+
+    def test_rollup_updates_cached_results(self):
+        url = reverse('polls:results', args=[self.question.pk])
+        self.assertNotContains(self.client.get(url), 'Votes per day')
+        self.add_event(self.first, 1)
+        rollup_votes()
+        self.assertContains(self.client.get(url), 'Votes per day')
+
+
+@override_settings(POLLS_PUBLIC_CACHE_SECONDS=60)
+class PublicPageTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Question', days=-5)
+        self.user = User.objects.create_user(username='user', password='password', is_staff=True)
+        self.urls = [
+            reverse('polls:index'),
+            reverse('polls:question', args=[self.question.pk]),
+            reverse('polls:results', args=[self.question.pk]),
+        ]
+
+    def get(self, url, **kwargs):
+        # Render every time rather than serving the cached results page.
+        cache.clear()
+        return self.client.get(url, **kwargs)
+
+    def test_same_body_for_everyone(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.client.logout()
+                anonymous = self.get(url)
+                self.client.force_login(self.user)
+                logged_in = self.get(url)
+                assert anonymous.content == logged_in.content
+                for response in (anonymous, logged_in):
+                    assert response['Cache-Control'] == 'public, max-age=0, s-maxage=60'
+                    assert 'Cookie' not in response.get('Vary', '')
+                    assert 'csrftoken' not in response.cookies
+                    self.assertNotContains(response, 'logout')
+
+    def test_session(self):
+        response = self.client.get(reverse('polls:session'))
+        data = response.json()
+        assert 'login' in data['navbar']
+        assert data['username'] == ''
+        assert 'no-cache' in response['Cache-Control']
+
+        self.client.force_login(self.user)
+        data = self.client.get(reverse('polls:session')).json()
+        assert 'logout' in data['navbar'] and 'admin' in data['navbar']
+        assert data['username'] == 'user'
+
+    def test_vote_with_session_token(self):
+        self.client = self.client_class(enforce_csrf_checks=True)
+        self.client.force_login(self.user)
+        self.client.get(reverse('polls:question', args=[self.question.pk]))
+        token = self.client.get(reverse('polls:session')).json()['csrf_token']
+        response = self.client.post(
+            reverse('polls:vote', args=[self.question.pk]),
+            {'choice': self.question.choice_set.first().pk, 'csrfmiddlewaretoken': token},
+        )
+        assert response.status_code == 302
+
+    def test_private_responses(self):
+        self.client.cookies[PIN_COOKIE] = '1'
+        assert self.get(self.urls[0])['Cache-Control'] == 'private'
+        del self.client.cookies[PIN_COOKIE]
+
+        hidden = create_question(question_text='Future question', days=5)
+        self.client.force_login(User.objects.create_superuser(username='admin', password='password'))
+        response = self.get(reverse('polls:results', args=[hidden.pk]))
+        assert response['Cache-Control'] == 'private'
+        assert 'Cookie' in response['Vary']
+
+    @override_settings(POLLS_PUBLIC_CACHE_SECONDS=0)
+    def test_disabled(self):
+        self.client.force_login(self.user)
+        response = self.get(self.urls[1])
+        assert not response.has_header('Cache-Control')
+        self.assertContains(response, 'logout')
+        self.assertContains(response, 'value="user"')
@@ -11,4 +11,11 @@ urlpatterns = [
     path('users/', views.UserListView.as_view(), name='user_list'),
     path('users/<int:pk>', views.UserView.as_view(), name='user'),
     path('<int:pk>/add_comment/', views.CreateCommentView.as_view(), name='add_comment'),
+    path('<int:pk>/comments/', views.CommentListView.as_view(), name='comments'),
+    path('<int:pk>/trends/', views.TrendsView.as_view(), name='trends'),
+    path('api/results/', views.results_api, name='results_api'),
+    path('export/<str:kind>/', views.export, name='export'),
+    path('stats/', views.stats, name='stats'),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('session/', views.user_session, name='session'),
 ]
@@ -1,91 +1,538 @@
+import datetime
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
-from django.http import Http404, HttpResponseRedirect
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Min
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotModified,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
+from django.template.response import SimpleTemplateResponse
 from django.urls import reverse
 from django.utils import timezone
-from django.views.generic import CreateView, DetailView, ListView
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date, parse_etags, quote_etag
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET
+from django.views.generic import CreateView, DetailView, ListView, View
+from django.views.generic.detail import SingleObjectMixin
+
+from .buffer import get_vote_buffer
+from .cache import (
+    get_or_set,
+    index_key,
+    index_version,
+    question_key,
+    question_version,
+    question_versions,
+    start_question_versions,
+    voted_key,
+)
+from .export import EXPORTS, FORMATS, parse_bound, stream_export
+from .forms import CommentForm, InlineCommentForm
+from .middleware import PIN_COOKIE, route_stats
+from .models import Choice, ChoiceShard, Question, QuestionStats, Vote, VoteEvent, VoteRollup
+from .pagination import KeysetPaginationMixin, KeysetPaginator
+from .ratelimit import write_limited
+from .rollups import daily_votes, trends
+from .search import search_questions
+from .signals import vote_cast
+
+
+class PublicPageMixin:
+    """
+    With `POLLS_PUBLIC_CACHE_SECONDS` set, render the page the same for every
+    user, without the account links and CSRF token (the page fetches those
+    from `user_session`), and let shared caches (not browsers) keep it that long.
 
-from .forms import CommentForm
-from .models import Choice, Question
+    Responses that looked at the session, such as hidden questions shown to
+    superusers, stay private. So do responses to clients pinned to the
+    primary database after a write; a reverse proxy in front should also pass
+    their requests (with the ``polls_primary`` cookie) through its cache.
+    """
 
+    def public_page(self):
+        return bool(settings.POLLS_PUBLIC_CACHE_SECONDS)
 
-class IndexView(ListView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['public_page'] = self.public_page()
+        return context
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        if not self.public_page() or request.method not in ('GET', 'HEAD'):
+            return response
+        # Whether the session gets accessed is only known once the template is rendered.
+        if isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
+            response.add_post_render_callback(self.patch_cache_headers)
+        else:
+            self.patch_cache_headers(response)
+        return response
+
+    def patch_cache_headers(self, response):
+        if response.status_code != 200:
+            return
+        session = getattr(self.request, 'session', None)
+        if session is not None and session.accessed or PIN_COOKIE in self.request.COOKIES:
+            patch_cache_control(response, private=True)
+        else:
+            # Not the browser's own cache, which would answer the redirect after a vote or comment.
+            patch_cache_control(response, public=True, max_age=0, s_maxage=settings.POLLS_PUBLIC_CACHE_SECONDS)
+
+
+class IndexView(PublicPageMixin, KeysetPaginationMixin, ListView):
     template_name = 'polls/index.html'
     context_object_name = 'latest_question_list'
+    keyset_ordering = ['-pub_date', '-id']
+    paginate_by = 5
 
     def get_queryset(self):
-        """Return the last five published questions."""
-        return Question.objects.filter(pub_date__lte=timezone.now()).order_by('-pub_date')[:5]
+        return Question.objects.visible()
 
+    def get_page(self, queryset, page_size, cursor):
+        """
+        The first page holds the latest published questions. It is cached
+        until the next scheduled question is due, so that one shows up on time.
+        """
+        if cursor:
+            return super().get_page(queryset, page_size, cursor)
+        # Invalidating the index while it is read starts a new version, so
+        # the page read under the old one is never served.
+        key = index_key(index_version())
+        page = cache.get(key)
+        if page is None:
+            now = timezone.now()
+            page = super().get_page(queryset, page_size, cursor)
+            timeout = settings.POLLS_CACHE_TIMEOUT
+            next_pub_date = Question.objects.filter(pub_date__gt=now).aggregate(Min('pub_date'))['pub_date__min']
+            if next_pub_date is not None:
+                timeout = min(timeout, (next_pub_date - now).total_seconds())
+            cache.set(key, page, timeout)
+        return page
 
-class QuestionView(DetailView):
-    model = Question
-    template_name = 'polls/question.html'
+
+class CachedQuestionMixin:
+    """
+    Load a visible question through a versioned cache and expose
+    `cache_version` for fragment caching. Hidden questions are only shown to
+    superusers and bypass the cache altogether (`cache_version` is None).
+    """
+
+    cache_version = None
 
     def get_object(self, queryset=None):
-        question = super().get_object(queryset)
-        if question.is_hidden() and not self.request.user.is_superuser:
-            raise Http404('No question found matching the query')
+        pk = self.kwargs['pk']
+        version = question_version(pk)
+        try:
+            if version is not None:
+                question = get_or_set(question_key(pk, version, 'object'), self.get_visible_object)
+            else:
+                # Start the version once the question turned out to exist.
+                started = time.time_ns()
+                question = self.get_visible_object()
+                version = start_question_versions([pk], started)[pk]
+                if version != started:
+                    # Changed while it was read, don't cache what was read.
+                    return question
+                cache.set(question_key(pk, version, 'object'), question, settings.POLLS_CACHE_TIMEOUT)
+        except Http404:
+            if not self.request.user.is_superuser:
+                raise
+            return super().get_object(Question.objects.with_has_choices())
+        self.cache_version = version
         return question
 
+    def get_visible_object(self):
+        return super().get_object(Question.objects.visible())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cache_version'] = self.cache_version
+        context['cache_timeout'] = settings.POLLS_CACHE_TIMEOUT
+        return context
+
+
+def comment_page(question, cursor=None):
+    """A page of the question's comments, newest first."""
+    comments = question.comment_set.all()
+    return KeysetPaginator(comments, ['-created_date', '-id'], settings.POLLS_COMMENTS_PER_PAGE).page(cursor)
+
+
+class QuestionView(PublicPageMixin, CachedQuestionMixin, DetailView):
+    model = Question
+    template_name = 'polls/question.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Lazy, so that a cached comments fragment doesn't query them.
+        cursor = self.request.GET.get('comments')
+        context['comments'] = SimpleLazyObject(lambda: comment_page(self.object, cursor))
+        username = None if self.public_page() else self.request.user.username
+        context['comment_form'] = InlineCommentForm(username=username)
+        context['choices'] = self.object.choice_set.order_by('pk')
+        return context
+
+
+class CommentListView(CachedQuestionMixin, SingleObjectMixin, View):
+    """Further pages of the question's comments as JSON with a rendered HTML fragment."""
 
-class ResultsView(DetailView):
+    model = Question
+
+    def get(self, request, *args, **kwargs):
+        question = self.get_object()
+        cursor = request.GET.get('cursor', '')
+        if self.cache_version is None:
+            return JsonResponse(self.render_page(question, cursor))
+        key = question_key(question.pk, self.cache_version, 'comments', hashlib.md5(cursor.encode()).hexdigest())
+        return JsonResponse(get_or_set(key, lambda: self.render_page(question, cursor)))
+
+    def render_page(self, question, cursor):
+        page = comment_page(question, cursor)
+        next_url = None
+        if page.has_next():
+            next_url = f"{reverse('polls:comments', args=[question.pk])}?cursor={page.next_cursor}"
+        return {'html': render_to_string('polls/comment_list.html', {'comments': page}), 'next_url': next_url}
+
+
+class ResultsView(PublicPageMixin, CachedQuestionMixin, DetailView):
     model = Question
     template_name = 'polls/results.html'
 
-    def get_object(self, queryset=None):
-        question = super().get_object(queryset)
-        if question.is_hidden() and not self.request.user.is_superuser:
-            raise Http404('No question found matching the query')
-        return question
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        context = self.get_context_data(object=self.object)
+        if self.cache_version is None:
+            return self.render_to_response(context)
+
+        # The page only varies per user through the navbar, unless it is public.
+        if self.public_page():
+            navbar = 'public'
+        else:
+            user = request.user
+            navbar = 'staff' if user.is_staff else 'user' if user.is_authenticated else 'anon'
+        key = question_key(self.object.pk, self.cache_version, 'results', navbar)
+        content = cache.get(key)
+        if content is None:
+            response = self.render_to_response(context).render()
+            cache.set(key, response.content, settings.POLLS_CACHE_TIMEOUT)
+            return response
+        return HttpResponse(content)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['choices'] = self.object.choice_set.with_total_votes()
+        # Lazy, so that serving the cached page doesn't query them.
+        context['stats'] = SimpleLazyObject(lambda: QuestionStats.objects.filter(pk=self.object.pk).first())
+        context['daily_votes'] = SimpleLazyObject(lambda: daily_votes(self.object.pk, TRENDS_DAYS[VoteRollup.DAY]))
+        return context
+
+
+# How far back trends go, in days, per period.
+TRENDS_DAYS = {VoteRollup.HOUR: 2, VoteRollup.DAY: 30}
+
+
+class TrendsView(CachedQuestionMixin, SingleObjectMixin, View):
+    """Votes per choice per hour or day (`period`) as JSON, read from the rollups only."""
+
+    model = Question
+
+    def get(self, request, *args, **kwargs):
+        question = self.get_object()
+        period = request.GET.get('period', VoteRollup.DAY)
+        if period not in TRENDS_DAYS:
+            return HttpResponseBadRequest(f'period must be one of {", ".join(TRENDS_DAYS)}')
+        since = timezone.now() - datetime.timedelta(days=TRENDS_DAYS[period])
+        series = trends(question.pk, period, since)
+        return JsonResponse(
+            {
+                'period': period,
+                'choices': [
+                    {'id': choice_id, 'votes': [[start.isoformat(), votes] for start, votes in points]}
+                    for choice_id, points in series.items()
+                ],
+            }
+        )
+
+
+RESULTS_API_MAX_IDS = 100
+# Larger ids don't fit the database's integers.
+MAX_QUESTION_ID = 2**63 - 1
+
+
+@require_GET
+def results_api(request):
+    """
+    Choices and vote counts of the visible questions in `ids`, a comma
+    separated list, as JSON. The ETag is derived from the versions of the
+    requested questions and the time the next of them is scheduled to be
+    published, so a repeated request with a matching ETag gets a 304 without
+    touching the database, even once the response dropped out of the cache.
+    """
+    try:
+        ids = sorted({int(pk) for pk in request.GET.get('ids', '').split(',') if pk})
+    except ValueError:
+        ids = None
+    if ids is None or not all(0 < pk <= MAX_QUESTION_ID for pk in ids):
+        return HttpResponseBadRequest('ids must be a comma separated list of question ids')
+    if not 0 < len(ids) <= RESULTS_API_MAX_IDS:
+        return HttpResponseBadRequest(f'Between 1 and {RESULTS_API_MAX_IDS} question ids are required')
+
+    versions = question_versions(ids)
+    missing = [pk for pk in ids if pk not in versions]
+    if missing:
+        started = time.time_ns()
+        existing = Question.objects.filter(pk__in=missing).values_list('pk', flat=True)
+        versions.update(start_question_versions(existing, started))
+    version_hash = hashlib.md5(json.dumps(sorted(versions.items())).encode()).hexdigest()
+    now = timezone.now()
+    for etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        etag_hash, _, expires = etag.replace('W/', '', 1).strip('"').partition('-')
+        # Results also change when a scheduled question gets published.
+        if etag_hash == version_hash and expires.isdigit() and (expires == '0' or int(expires) > now.timestamp()):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+    key = f'polls:results-api:{version_hash}'
+    results = cache.get(key)
+    if results is None or results['expires'] and results['expires'] <= now:
+        results = results_api_payload(ids, versions)
+        cache.set(key, results, settings.POLLS_CACHE_TIMEOUT)
+
+    expires = int(results['expires'].timestamp()) if results['expires'] else 0
+    response = HttpResponse(results['body'], content_type='application/json')
+    response['ETag'] = quote_etag(f'{version_hash}-{expires}')
+    response['Last-Modified'] = http_date(results['last_modified'])
+    return get_conditional_response(request, last_modified=results['last_modified'], response=response)
+
+
+def results_api_payload(ids, versions):
+    """Build the cached `results_api` response body with two queries."""
+    now = timezone.now()
+    questions = Question.objects.filter(pk__in=ids).with_has_choices()
+    visible = [question for question in questions if not question.is_hidden()]
+    data = {
+        question.pk: {'id': question.pk, 'question_text': question.question_text, 'choices': []}
+        for question in visible
+    }
+    for choice in Choice.objects.filter(question__in=visible).with_total_votes():
+        data[choice.question_id]['choices'].append(
+            {'id': choice.pk, 'choice_text': choice.choice_text, 'votes': choice.total_votes}
+        )
+
+    scheduled = [question.pub_date for question in questions if question.pub_date > now]
+    changed = [question.pub_date.timestamp() for question in visible]
+    changed += [version / 1e9 for version in versions.values()]
+    return {
+        'body': json.dumps({'questions': [data[pk] for pk in ids if pk in data]}),
+        'last_modified': int(max(changed, default=0)),
+        'expires': min(scheduled, default=None),
+    }
+
+
+@staff_member_required
+@require_GET
+def export(request, kind):
+    """
+    Stream all results or comments as CSV or NDJSON (`format`), optionally
+    gzipped (`gzip=1`) and limited to questions published in [`since`, `until`).
+    """
+    fmt = request.GET.get('format', 'csv')
+    if kind not in EXPORTS or fmt not in FORMATS:
+        raise Http404('No such export')
+    try:
+        since, until = parse_bound(request.GET.get('since')), parse_bound(request.GET.get('until'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    compress = request.GET.get('gzip') == '1'
+    filename = f'{kind}.{fmt}.gz' if compress else f'{kind}.{fmt}'
+    response = StreamingHttpResponse(
+        stream_export(kind, fmt, since, until, compress),
+        content_type='application/gzip' if compress else FORMATS[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@staff_member_required
+@require_GET
+def stats(request):
+    """Per-route latency histograms and sampled profiles recorded by this process."""
+    if request.GET.get('reset') == '1':
+        route_stats.reset()
+    return JsonResponse(route_stats.snapshot())
+
+
+@never_cache
+@require_GET
+def user_session(request):
+    """The per-user parts of public pages: the account links of the navbar, a CSRF token and the username."""
+    return JsonResponse(
+        {
+            'navbar': render_to_string('polls/navbar_user.html', request=request),
+            'csrf_token': get_token(request),
+            'username': request.user.username,
+        }
+    )
+
+
+def voted_questions(user):
+    """Ids of the questions the user has voted on, cached so duplicates are mostly turned away without a query."""
+    return cache.get_or_set(
+        voted_key(user.pk),
+        lambda: set(Vote.objects.filter(user=user).values_list('question_id', flat=True)),
+        settings.POLLS_CACHE_TIMEOUT,
+    )
+
+
+def vote_error(request, question, message, status=200):
+    """Redisplay the question voting form with an error."""
+    context = {
+        'question': question,
+        'choices': question.choice_set.order_by('pk'),
+        'comments': comment_page(question),
+        'comment_form': InlineCommentForm(username=request.user.username),
+        'error_message': message,
+    }
+    return render(request, 'polls/question.html', context, status=status)
 
 
 @login_required
+@write_limited('vote')
 def vote(request, question_id):
     question = get_object_or_404(Question, pk=question_id)
     try:
         selected_choice = question.choice_set.get(pk=request.POST['choice'])
     except (KeyError, Choice.DoesNotExist):
-        # Redisplay the question voting form.
-        return render(
-            request, 'polls/question.html', {'question': question, 'error_message': "You didn't select a choice."}
-        )
-    else:
-        selected_choice.votes += 1
-        selected_choice.save()
-        # Always return an HttpResponseRedirect after successfully dealing
-        # with POST data. This prevents data from being posted twice if a
-        # user hits the Back button.
-        return HttpResponseRedirect(reverse('polls:results', args=[question.id]))
+        return vote_error(request, question, "You didn't select a choice.")
+
+    voted = voted_questions(request.user)
+    if question.id in voted:
+        return vote_error(request, question, 'You have already voted on this question.', status=409)
+    try:
+        # The ledger entry and the counter update are committed together.
+        with transaction.atomic():
+            Vote.objects.create(user=request.user, question=question, choice=selected_choice)
+            VoteEvent.objects.create(question=question, choice=selected_choice)
+            if settings.POLLS_VOTE_BUFFER:
+                # Journaled last, so that a failed write rolls the ledger entry
+                # back; a full buffer is flushed below, once the vote is committed.
+                get_vote_buffer().add(selected_choice.id, flush=False)
+            elif settings.POLLS_VOTE_SHARDS:
+                ChoiceShard.increment(selected_choice.id, settings.POLLS_VOTE_SHARDS)
+            else:
+                Choice.objects.filter(pk=selected_choice.id).update(votes=F('votes') + 1)
+    except IntegrityError:
+        # Voted in another request since the set was cached.
+        cache.delete(voted_key(request.user.pk))
+        return vote_error(request, question, 'You have already voted on this question.', status=409)
+
+    if settings.POLLS_VOTE_BUFFER:
+        get_vote_buffer().flush_if_full()
+    cache.set(voted_key(request.user.pk), voted | {question.id}, settings.POLLS_CACHE_TIMEOUT)
+    vote_cast.send(sender=Choice, question_id=question.id, choice_id=selected_choice.id)
+    # Always return an HttpResponseRedirect after successfully dealing
+    # with POST data. This prevents data from being posted twice if a
+    # user hits the Back button.
+    return HttpResponseRedirect(reverse('polls:results', args=[question.id]))
+
+
+class SearchView(ListView):
+    template_name = 'polls/search.html'
+    context_object_name = 'questions'
+    paginate_by = 10
+
+    def get_queryset(self):
+        return search_questions(self.request.GET.get('q', ''))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.request.GET.get('q', '')
+        return context
 
 
-class UserListView(LoginRequiredMixin, ListView):
-    model = User
+class UserListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    queryset = User.objects.select_related('profile')
     template_name = 'polls/user_list.html'
+    paginate_by = 50
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['staff'] = [user for user in User.objects.all() if user.is_staff]
-        context['non_staff'] = [user for user in User.objects.all() if not user.is_staff]
+        cursors = self.request.GET
+        context['staff'] = self.get_page(
+            self.object_list.filter(is_staff=True), self.paginate_by, cursors.get('staff_cursor')
+        )
+        context['non_staff'] = self.get_page(
+            self.object_list.filter(is_staff=False), self.paginate_by, cursors.get('non_staff_cursor')
+        )
         return context
 
 
 class UserView(LoginRequiredMixin, DetailView):
-    model = User
+    queryset = User.objects.select_related('profile')
     template_name = 'polls/user.html'
 
 
+@method_decorator(write_limited('comment'), name='dispatch')
 class CreateCommentView(CreateView):
+    """
+    Add a comment to the question in the URL. Requests sent with
+    ``X-Requested-With: XMLHttpRequest`` get the rendered comment (201) or
+    the form errors as JSON (400) instead of a redirect or the form page.
+    """
+
     form_class = CommentForm
     template_name = 'polls/add_comment.html'
 
-    def get_success_url(self):
-        return reverse('polls:question', kwargs={'pk': self.object.question.id})
+    def dispatch(self, request, *args, **kwargs):
+        self.question = get_object_or_404(Question, pk=kwargs['pk'])
+        return super().dispatch(request, *args, **kwargs)
+
+    def is_ajax(self):
+        return self.request.headers.get('X-Requested-With') == 'XMLHttpRequest'
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
-        kwargs['question_pk'] = self.kwargs.get('pk')
         kwargs['username'] = self.request.user.username
         return kwargs
+
+    def get_context_data(self, **kwargs):
+        kwargs['question'] = self.question
+        return super().get_context_data(**kwargs)
+
+    def form_valid(self, form):
+        form.instance.question = self.question
+        if not self.is_ajax():
+            return super().form_valid(form)
+        self.object = form.save()
+        return HttpResponse(
+            render_to_string('polls/comment.html', {'comment': self.object}, request=self.request), status=201
+        )
+
+    def form_invalid(self, form):
+        if self.is_ajax():
+            return JsonResponse({'errors': form.errors}, status=400)
+        return super().form_invalid(form)
+
+    def get_success_url(self):
+        return reverse('polls:question', kwargs={'pk': self.question.id})